@@ -12,6 +12,20 @@ from dataclasses import dataclass, field
 from enum import Enum
 from thefuzz import fuzz, process
 
+# Regular expressions compiled once at import time instead of on every query
+LIMIT_RE = re.compile(r'\b(\d+)\b')
+COMPANY_NAME_RES = [
+    re.compile(pattern, re.IGNORECASE)
+    for pattern in [
+        r'empresa\s+([A-Za-z0-9\s]+)',
+        r'compañía\s+([A-Za-z0-9\s]+)',
+        r'sociedad\s+([A-Za-z0-9\s]+)',
+        r'información(?:\s+\w+){0,3}\s+de\s+([A-Za-z0-9\s]+)',
+        r'datos(?:\s+\w+){0,3}\s+de\s+([A-Za-z0-9\s]+)'
+    ]
+]
+COMPANY_SUFFIX_RE = re.compile(r'\b(S\.?A\.?|S\.?L\.?)$')
+
 class CustomLLM(LLM):
     def __init__(self, model_name: str, provider: str = "groq"):
         super().__init__()
@@ -186,7 +200,7 @@ Output: {
         ctx.province = self.extract_province_fuzzy(query_normalized)
 
         # Extract limit
-        match = re.search(r'\b(\d+)\b', query)
+        match = LIMIT_RE.search(query)
         if match:
             ctx.limit = int(match.group(1))
 
@@ -277,20 +291,12 @@ Output: {
 
     def extract_company_name(self, query: str) -> Optional[str]:
         """Extract company name from query using patterns"""
-        patterns = [
-            r'empresa\s+([A-Za-z0-9\s]+)',
-            r'compañía\s+([A-Za-z0-9\s]+)',
-            r'sociedad\s+([A-Za-z0-9\s]+)',
-            r'información(?:\s+\w+){0,3}\s+de\s+([A-Za-z0-9\s]+)', 
-            r'datos(?:\s+\w+){0,3}\s+de\s+([A-Za-z0-9\s]+)'
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, query, re.IGNORECASE)
+        for pattern in COMPANY_NAME_RES:
+            match = pattern.search(query)
             if match:
                 company_name = match.group(1).strip()
                 # Remove common company suffixes for better matching
-                company_name = re.sub(r'\b(S\.?A\.?|S\.?L\.?)$', '', company_name).strip()
+                company_name = COMPANY_SUFFIX_RE.sub('', company_name).strip()
                 return company_name
         
         return None
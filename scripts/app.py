@@ -82,6 +82,8 @@ class EnterpriseApp:
             
     def setup_rag_system(self):
         """Initialize the Financial RAG System"""
+        # Save the chunks still buffered by the previous system before replacing it
+        self.close_rag_system()
         try:
             # Create the RAG system with selected model
             self.rag_system = FinancialRAGSystem(
@@ -90,6 +92,15 @@ class EnterpriseApp:
         except Exception as e:
             st.error(f"Error setting up RAG system: {str(e)}")
             
+    def close_rag_system(self):
+        """Flush the RAG system's pending chunks to the vector store"""
+        rag_system = getattr(self, "rag_system", None)
+        if rag_system is not None:
+            try:
+                rag_system.close()
+            except Exception as e:
+                logger.error(f"Error closing RAG system: {str(e)}")
+            
     def load_data_from_db(self):
         """Load data from database if session is empty"""
         if st.session_state.current_batch is None:
@@ -785,4 +796,8 @@ class EnterpriseApp:
 
 if __name__ == "__main__":
     app = EnterpriseApp()
-    app.run()
\ No newline at end of file
+    try:
+        app.run()
+    finally:
+        # Streamlit reruns the script on every interaction: index what this run buffered
+        app.close_rag_system()
\ No newline at end of file
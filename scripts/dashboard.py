@@ -7,7 +7,7 @@ import time
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
-import json
+import orjson
 from task_manager import TaskManager
 from database_supabase import SupabaseDatabaseManager
 from redis_config import REDIS_QUEUE_PROCESSING, REDIS_QUEUE_PENDING, REDIS_QUEUE_COMPLETED, REDIS_QUEUE_FAILED
@@ -127,40 +127,51 @@ class ScrapingDashboard:
             # Buscar todos los heartbeats activos
             active_workers = {}
             
-            # Patrón para buscar todos los heartbeats de tareas
-            heartbeat_keys = self.task_manager.redis.keys("task:*:heartbeat")
+            # Consultar el tamaño de la cola antes que nada (O(1)): si está vacía no hay nada que cruzar
+            if not self.task_manager.redis.llen(REDIS_QUEUE_PROCESSING):
+                return []
+            
+            # Heartbeats de tareas mediante SCAN con patrón, en vez de un KEYS que recorre
+            # de golpe todo el keyspace (incluida la caché de páginas) bloqueando Redis
+            heartbeat_keys = list(self.task_manager.redis.scan_iter(match="task:*:heartbeat", count=1000))
             
             if not heartbeat_keys:
                 return []
             
+            # Leer la cola de procesamiento una sola vez (y no una vez por heartbeat)
+            # e indexarla por task_id para cruzarla con los heartbeats
+            processing_tasks = [
+                Task.from_json(task_json)
+                for task_json in self.task_manager.redis.lrange(REDIS_QUEUE_PROCESSING, 0, -1)
+            ]
+            tasks_by_id = {task.task_id: task for task in processing_tasks}
+            
             # Para cada heartbeat, obtener la tarea correspondiente
             for key in heartbeat_keys:
                 # Extraer el task_id del patrón "task:{task_id}:heartbeat"
                 task_id = key.split(':')[1]
                 
                 # Buscar esta tarea en la cola de procesamiento
-                processing_queue = self.task_manager.redis.lrange(REDIS_QUEUE_PROCESSING, 0, -1)
+                task = tasks_by_id.get(task_id)
+                if task is None:
+                    continue
                 
-                for task_json in processing_queue:
-                    task = Task.from_json(task_json)
-                    
-                    if task.task_id == task_id:
-                        worker_id = task.worker_id
-                        
-                        if worker_id not in active_workers:
-                            active_workers[worker_id] = {
-                                'worker_id': worker_id,
-                                'tasks': 0,
-                                'last_update': time.time(),
-                                'last_company': task.company_data.get('razon_social', 'Desconocida')
-                            }
-                        
-                        active_workers[worker_id]['tasks'] += 1
-                        
-                        # Actualizar si esta tarea es más reciente
-                        if task.started_at > active_workers[worker_id]['last_update']:
-                            active_workers[worker_id]['last_update'] = task.started_at
-                            active_workers[worker_id]['last_company'] = task.company_data.get('razon_social', 'Desconocida')
+                worker_id = task.worker_id
+                
+                if worker_id not in active_workers:
+                    active_workers[worker_id] = {
+                        'worker_id': worker_id,
+                        'tasks': 0,
+                        'last_update': time.time(),
+                        'last_company': task.company_data.get('razon_social', 'Desconocida')
+                    }
+                
+                active_workers[worker_id]['tasks'] += 1
+                
+                # Actualizar si esta tarea es más reciente
+                if task.started_at > active_workers[worker_id]['last_update']:
+                    active_workers[worker_id]['last_update'] = task.started_at
+                    active_workers[worker_id]['last_company'] = task.company_data.get('razon_social', 'Desconocida')
             
             # Convertir el diccionario a una lista de registros
             workers_list = list(active_workers.values())
@@ -168,12 +179,9 @@ class ScrapingDashboard:
             # Si la lista está vacía, intentar un enfoque alternativo:
             # Revisar todas las tareas en procesamiento para extraer workers
             if not workers_list:
-                processing_tasks = self.task_manager.redis.lrange(REDIS_QUEUE_PROCESSING, 0, -1)
                 processing_workers = {}
                 
-                for task_json in processing_tasks:
-                    task = Task.from_json(task_json)
-                    
+                for task in processing_tasks:
                     if task.worker_id:
                         if task.worker_id not in processing_workers:
                             processing_workers[task.worker_id] = {
@@ -227,19 +235,15 @@ class ScrapingDashboard:
         WHERE processed = TRUE
         """
         
-        df = self.db.execute_query(query, return_df=True)
-
-        # Si df no es un DataFrame, forzarlo a uno vacío
-        if not isinstance(df, pd.DataFrame):
-            df = pd.DataFrame(columns=['total', 'success', 'failed'])
-
-        if df.empty:
+        # Una sola fila de agregados: se lee como diccionario, sin construir un DataFrame
+        rows = self.db.execute_query_dicts(query)
+        if not rows:
             return {'total': 0, 'success': 0, 'failed': 0, 'rate': 0}
         
-        # Extrae valores del dataframe
-        total = df.iloc[0]['total'] if 'total' in df.columns else 0
-        success = df.iloc[0]['success'] if 'success' in df.columns else 0
-        failed = df.iloc[0]['failed'] if 'failed' in df.columns else 0
+        stats = rows[0]
+        total = stats.get('total') or 0
+        success = stats.get('success') or 0
+        failed = stats.get('failed') or 0
         
         # Calcula la tasa
         rate = (success / total * 100) if total > 0 else 0
@@ -291,8 +295,9 @@ class ScrapingDashboard:
                 self.increment_refresh_counter()
                 return 0
             
-            # Convertir DataFrame a lista de diccionarios
-            companies_list = pending_tasks.to_dict('records')
+            # Convertir DataFrame a lista de diccionarios (itertuples + zip es más rápido que to_dict('records'))
+            columns = pending_tasks.columns.tolist()
+            companies_list = [dict(zip(columns, row)) for row in pending_tasks.itertuples(index=False, name=None)]
             total_found = len(companies_list)
             
             # Get current pending tasks to avoid duplicates
@@ -300,7 +305,7 @@ class ScrapingDashboard:
             current_company_ids = []
             for task_json in pending_tasks_json:
                 try:
-                    task_data = json.loads(task_json)
+                    task_data = orjson.loads(task_json)
                     if 'company_id' in task_data:
                         current_company_ids.append(task_data['company_id'])
                 except:
@@ -1,10 +1,12 @@
 # database.py
 
+import io
 import psycopg2
+from psycopg2 import sql
 import pandas as pd
 import numpy as np
 from typing import Optional, List, Dict, Any
-from psycopg2.extras import execute_values
+from psycopg2.extras import execute_batch, execute_values, RealDictCursor
 from config import DB_CONFIG, HARDWARE_CONFIG, TIMEOUT_CONFIG
 import platform
 from db_validator import DataProcessor
@@ -16,6 +18,7 @@ class DatabaseManager:
     def __init__(self):
         self.connection = psycopg2.connect(**DB_CONFIG)
         self.connection.autocommit = True
+        self._update_prepared = False
         self.data_processor = DataProcessor()
         self._optimize_connection()
         self.create_table_if_not_exists()
@@ -85,6 +88,40 @@ class DatabaseManager:
             self._reconnect()
             return None
 
+    def execute_query_dicts(self, query: str, params: tuple = None) -> List[Dict[str, Any]]:
+        """
+        Executes a SELECT query and returns the rows as a list of dicts,
+        without building an intermediate DataFrame.
+        
+        Args:
+            query (str): SQL query to execute
+            params (tuple, optional): Query parameters. Defaults to None.
+            
+        Returns:
+            List[Dict[str, Any]]: One dict per row, deduplicated by cod_infotel if present
+        """
+        try:
+            if self.connection.closed:
+                self._reconnect()
+                
+            with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(query, params)
+                if not cursor.description:
+                    return []
+                rows = cursor.fetchall()
+        except Exception as e:
+            print(f"Database error: {str(e)}")
+            self._reconnect()
+            return []
+        
+        # Remove duplicates if present (keeping the first occurrence, as drop_duplicates does)
+        if rows and 'cod_infotel' in rows[0]:
+            unique_rows = {}
+            for row in rows:
+                unique_rows.setdefault(row['cod_infotel'], row)
+            rows = list(unique_rows.values())
+        return [dict(row) for row in rows]
+
     def _handle_db_error(self, error: Exception, query: str) -> None:
         """
         Handles database errors in a more informative way.
@@ -104,6 +141,7 @@ class DatabaseManager:
             pass
         self.connection = psycopg2.connect(**DB_CONFIG)
         self.connection.autocommit = True
+        self._update_prepared = False
         self._optimize_connection()
 
     def batch_insert(self, df: pd.DataFrame, table: str, columns: List[str]) -> Dict[str, Any]:
@@ -119,12 +157,18 @@ class DatabaseManager:
             
             df_chunks = [df[i:i + chunk_size] for i in range(0, len(df), chunk_size)]
             
+            # Tabla y columnas como identificadores, no interpolados en el texto
+            insert_query = sql.SQL("INSERT INTO {} ({}) VALUES %s").format(
+                sql.Identifier(table),
+                sql.SQL(', ').join(map(sql.Identifier, columns))
+            )
+            
             with self.connection.cursor() as cursor:
                 for chunk in df_chunks:
                     try:
-                        values = [tuple(row) for row in chunk[columns].values]
-                        insert_query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s"
-                        execute_values(cursor, insert_query, values)
+                        values = list(chunk[columns].itertuples(index=False, name=None))
+                        # Un único INSERT multi-fila por lote (por defecto execute_values parte cada 100 filas)
+                        execute_values(cursor, insert_query, values, page_size=chunk_size)
                         total_inserted += len(chunk)
                     except Exception as e:
                         errors.append(str(e))
@@ -139,7 +183,72 @@ class DatabaseManager:
         except Exception as e:
             return {"status": "error", "message": str(e), "errors": errors}
 
+    def copy_insert(self, df: pd.DataFrame, table: str, columns: List[str]) -> Dict[str, Any]:
+        """
+        Carga el DataFrame con COPY en una tabla temporal y pasa a `table`, en una sola
+        sentencia, las filas cuyo cod_infotel aún no existe (anti-join en lugar de
+        comprobar el índice fila a fila).
+        """
+        if df.empty:
+            return {"status": "success", "inserted": 0, "total": 0, "errors": []}
+
+        data = df[columns].copy()
+        # Columnas enteras que pandas convirtió a float por tener nulos (1234.0 no entra en un INTEGER)
+        for column in data.columns:
+            values = data[column].dropna()
+            if pd.api.types.infer_dtype(values, skipna=True) in ('floating', 'mixed-integer-float') \
+                    and (values.astype(float) % 1 == 0).all():
+                data[column] = data[column].astype('Int64')
+
+        # En CSV, los valores vacíos sin comillas (None, NaN y '') se cargan como NULL
+        buffer = io.StringIO()
+        data.to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+
+        # Tabla y columnas como identificadores, no interpolados en el texto
+        target = sql.Identifier(table)
+        staging = sql.Identifier(f"{table}_stg")
+        column_list = sql.SQL(', ').join(map(sql.Identifier, columns))
+        staged_columns = sql.SQL(', ').join(sql.Identifier('s', column) for column in columns)
+        self.connection.autocommit = False
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute(
+                    sql.SQL("CREATE TEMP TABLE {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA")
+                    .format(staging, column_list, target)
+                )
+                copy_query = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(staging, column_list)
+                cursor.copy_expert(copy_query.as_string(cursor), buffer)
+                cursor.execute(sql.SQL("""
+                    INSERT INTO {target} ({columns})
+                    SELECT DISTINCT ON (s.cod_infotel) {staged_columns}
+                    FROM {staging} s
+                    LEFT JOIN {target} t USING (cod_infotel)
+                    WHERE t.cod_infotel IS NULL
+                """).format(target=target, columns=column_list, staged_columns=staged_columns, staging=staging))
+                inserted = cursor.rowcount
+            self.connection.commit()
+        except Exception as e:
+            self.connection.rollback()
+            return {"status": "error", "message": str(e), "errors": [str(e)]}
+        finally:
+            self.connection.autocommit = True
+
+        return {
+            "status": "success" if inserted == len(df) else "partial",
+            "inserted": inserted,
+            "total": len(df),
+            "errors": []
+        }
+
     def save_batch(self, df: pd.DataFrame, check_duplicates: bool = False) -> Dict[str, Any]:
+        if df.empty:
+            return {"status": "success", "inserted": 0, "total": 0, "errors": []}
+
+        # Eliminar duplicados antes de las pasadas de limpieza y validación
+        if check_duplicates:
+            df = df.drop_duplicates(subset=['cod_infotel'])
+
         # Limpiar strings vacíos y espacios en blanco antes del procesamiento
         df = df.replace(r'^\s*$', None, regex=True)
         df = df.replace({np.nan: None})
@@ -164,10 +273,7 @@ class DatabaseManager:
             'url_status'
         ]
         
-        if check_duplicates:
-            df = df.drop_duplicates(subset=['cod_infotel'])  # Remove duplicates based on cod_infotel
-        
-        return self.batch_insert(df, 'sociedades', insert_columns)
+        return self.copy_insert(df, 'sociedades', insert_columns)
 
     def get_urls_for_scraping(self, limit: int = 10) -> pd.DataFrame:
         """Gets URLs that need to be scraped."""
@@ -175,7 +281,7 @@ class DatabaseManager:
         SELECT cod_infotel, url 
         FROM sociedades 
         WHERE url IS NOT NULL 
-        AND url != '' 
+        AND url <> '' 
         LIMIT %s
         """
         return self.execute_query(query, params=(limit,), return_df=True)
@@ -186,47 +292,80 @@ class DatabaseManager:
         result = self.execute_query(query, return_df=True)
         return result.iloc[0, 0] if result is not None else 0
 
+    def _prepare_update_statement(self, cursor) -> None:
+        """
+        Prepara en el servidor el UPDATE de resultados de scraping una vez por sesión,
+        para que PostgreSQL no tenga que volver a parsearlo y planificarlo en cada fila.
+        """
+        if self._update_prepared:
+            return
+        cursor.execute("""
+        PREPARE upd_sociedades (
+            boolean, text, integer, text, text, text, text,
+            text, text, text, text, text, boolean, integer
+        ) AS
+        UPDATE sociedades 
+        SET 
+            url_exists = $1,
+            url_limpia = $2,
+            url_status = $3,
+            url_status_mensaje = $4,
+            telefono_1 = $5,
+            telefono_2 = $6,
+            telefono_3 = $7,
+            facebook = $8,
+            twitter = $9,
+            linkedin = $10,
+            instagram = $11,
+            youtube = $12,
+            e_commerce = $13,
+            fecha_actualizacion = NOW()
+        WHERE cod_infotel = $14
+        """)
+        self._update_prepared = True
+
     def update_scraping_results(self, results: List[Dict[str, Any]]) -> Dict[str, Any]:
         try:
-            update_query = """
-            UPDATE sociedades 
-            SET 
-                url_exists = %(exists)s,
-                url_limpia = %(clean_url)s,
-                url_status = %(status)s,
-                url_status_mensaje = %(status_message)s,
-                telefono_1 = %(phone1)s,
-                telefono_2 = %(phone2)s,
-                telefono_3 = %(phone3)s,
-                facebook = %(facebook)s,
-                twitter = %(twitter)s,
-                linkedin = %(linkedin)s,
-                instagram = %(instagram)s,
-                youtube = %(youtube)s,
-                e_commerce = %(ecommerce)s,
-                fecha_actualizacion = NOW()
-            WHERE cod_infotel = %(cod_infotel)s
-            """
-            
+            params = []
+            for result in results:
+                phones = (result.get('phones') or []) + ['', '', '']
+                social_media = result.get('social_media') or {}
+                params.append((
+                    result.get('url_exists', False),
+                    result.get('url_limpia'),
+                    result.get('url_status'),
+                    result.get('url_status_mensaje'),
+                    phones[0],
+                    phones[1],
+                    phones[2],
+                    social_media.get('facebook'),
+                    social_media.get('twitter'),
+                    social_media.get('linkedin'),
+                    social_media.get('instagram'),
+                    social_media.get('youtube'),
+                    result.get('is_ecommerce', False),
+                    result.get('cod_infotel')
+                ))
+
             with self.connection.cursor() as cursor:
-                for result in results:
-                    params = {
-                        'exists': result.get('url_exists', False),
-                        'clean_url': result.get('url_limpia'),
-                        'status': result.get('url_status'),
-                        'status_message': result.get('url_status_mensaje'),
-                        'phone1': result.get('phones', [''])[0],
-                        'phone2': result.get('phones', ['', ''])[1],
-                        'phone3': result.get('phones', ['', '', ''])[2],
-                        'facebook': result.get('social_media', {}).get('facebook'),
-                        'twitter': result.get('social_media', {}).get('twitter'),
-                        'linkedin': result.get('social_media', {}).get('linkedin'),
-                        'instagram': result.get('social_media', {}).get('instagram'),
-                        'youtube': result.get('social_media', {}).get('youtube'),
-                        'ecommerce': result.get('is_ecommerce', False),
-                        'cod_infotel': result.get('cod_infotel')
-                    }
-                    cursor.execute(update_query, params)
+                self._prepare_update_statement(cursor)
+
+            # Enviar todas las filas en lotes y confirmar una sola vez
+            self.connection.autocommit = False
+            try:
+                with self.connection.cursor() as cursor:
+                    execute_batch(
+                        cursor,
+                        "EXECUTE upd_sociedades (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                        params,
+                        page_size=500
+                    )
+                self.connection.commit()
+            except Exception:
+                self.connection.rollback()
+                raise
+            finally:
+                self.connection.autocommit = True
                     
             return {"status": "success", "updated": len(results)}
         except Exception as e:
@@ -268,6 +407,11 @@ class DatabaseManager:
         -- Crear índice único si no existe
         CREATE UNIQUE INDEX IF NOT EXISTS idx_sociedades_cod_infotel 
         ON sociedades(cod_infotel);
+
+        -- Índice parcial con solo las empresas pendientes de scraping
+        CREATE INDEX IF NOT EXISTS idx_sociedades_pending 
+        ON sociedades(cod_infotel) 
+        WHERE processed = FALSE AND url IS NOT NULL AND url <> '';
         """
         try:
             self.execute_query(create_table_query, return_df=False)
@@ -1,8 +1,9 @@
 import json
 import os
+import re
 import pandas as pd
 import numpy as np
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Iterator
 from datetime import datetime
 from supabase_config import SUPABASE_DB_CONFIG
 from db_validator import DataProcessor
@@ -19,6 +20,22 @@ SUPABASE_KEY = os.getenv('SUPABASE_KEY')
 if not SUPABASE_URL or not SUPABASE_KEY:
     raise ValueError("Variables de entorno SUPABASE_URL y SUPABASE_KEY deben estar definidas")
 
+# Patrón para extraer la tabla de una consulta SELECT simple
+_FROM_RE = re.compile(r'FROM\s+(\w+)', re.IGNORECASE)
+
+# Redes sociales que se guardan como columnas en sociedades
+SOCIAL_NETWORKS = ['facebook', 'twitter', 'linkedin', 'instagram', 'youtube']
+
+# Valores por defecto de los campos escalares de un resultado de scraping
+UPDATE_DEFAULTS = {
+    'url_exists': False,
+    'url_valida': '',
+    'url_limpia': '',
+    'url_status': -1,
+    'url_status_mensaje': '',
+    'is_ecommerce': False,
+}
+
 class SupabaseDatabaseManager:
     def __init__(self):
         self.supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
@@ -79,16 +96,30 @@ class SupabaseDatabaseManager:
             print(f"Database error: {str(e)}")
             return None
     
+    def execute_query_dicts(self, query: str, params: tuple = None) -> List[Dict[str, Any]]:
+        """
+        Ejecuta una consulta SELECT y devuelve las filas como lista de dicts,
+        tal y como las entrega la API de Supabase, sin construir un DataFrame intermedio
+        """
+        rows = self.execute_query(query, params=params)
+        if not isinstance(rows, list):
+            return []
+        
+        # Eliminar duplicados por cod_infotel (conservando la primera aparición)
+        if rows and 'cod_infotel' in rows[0]:
+            unique_rows = {}
+            for row in rows:
+                unique_rows.setdefault(row['cod_infotel'], row)
+            rows = list(unique_rows.values())
+        return rows
+    
     def _extract_table_name(self, query: str) -> str:
         """
         Extrae el nombre de la tabla de una consulta SQL simple
         """
         # Buscar patrón "FROM table_name"
-        import re
-        match = re.search(r'FROM\s+(\w+)', query, re.IGNORECASE)
-        if match:
-            return match.group(1)
-        return "sociedades"  # Default table name
+        match = _FROM_RE.search(query)
+        return match.group(1) if match else "sociedades"  # Default table name
 
     def _handle_db_error(self, error: Exception, query: str) -> None:
         """
@@ -136,13 +167,8 @@ class SupabaseDatabaseManager:
                 try:
                     print(f"Processing chunk {chunk_idx+1}/{len(df_chunks)} with {len(chunk)} records")
                     
-                    # Preparar datos para inserción
-                    records = []
-                    for _, row in chunk[columns].iterrows():
-                        record = {}
-                        for col in columns:
-                            record[col] = row[col]
-                        records.append(record)
+                    # Preparar datos para inserción (itertuples + zip en lugar de iterrows)
+                    records = [dict(zip(columns, row)) for row in chunk[columns].itertuples(index=False, name=None)]
                     
                     print(f"Prepared {len(records)} records for insertion")
                     
@@ -177,6 +203,13 @@ class SupabaseDatabaseManager:
         print(f"Original dataframe shape: {df.shape}")
         print(f"Columns in dataframe: {df.columns.tolist()}")
         
+        if df.empty:
+            return {"status": "success", "inserted": 0, "total": 0, "errors": []}
+
+        # Eliminar duplicados antes de las pasadas de limpieza y validación
+        if check_duplicates:
+            df = df.drop_duplicates(subset=['cod_infotel'])
+
         # Limpiar strings vacíos y espacios en blanco antes del procesamiento
         df = df.replace(r'^\s*$', None, regex=True)
         df = df.replace({np.nan: None})
@@ -207,9 +240,6 @@ class SupabaseDatabaseManager:
             df['cod_infotel'] = df['cod_infotel'].fillna(0)
             df['cod_infotel'] = df['cod_infotel'].astype(float).astype(int)
         
-        if check_duplicates:
-            df = df.drop_duplicates(subset=['cod_infotel'])
-        
         # Solo pasar las columnas originales
         return self.batch_insert(df, 'sociedades', insert_columns)
         
@@ -229,11 +259,54 @@ class SupabaseDatabaseManager:
             return pd.DataFrame(response.data)
         return pd.DataFrame()
 
+    def iter_companies_to_process(self, batch_size: int = 10000) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Recorre las empresas no procesadas en lotes de batch_size filas, paginando por
+        cod_infotel (keyset), para no cargar todo el resultado en memoria de una vez
+        """
+        columns = 'cod_infotel, nif, razon_social, domicilio, cod_postal, nom_poblacion, nom_provincia, url'
+        batch = []
+        last_cod_infotel = None
+        
+        while True:
+            # processed IS NOT TRUE cubre tanto FALSE como NULL
+            query = self.supabase.table('sociedades') \
+                .select(columns) \
+                .filter('processed', 'not.is', 'true') \
+                .order('cod_infotel') \
+                .limit(batch_size - len(batch))
+            if last_cod_infotel is not None:
+                query = query.gt('cod_infotel', last_cod_infotel)
+            
+            # La API puede devolver menos filas que el límite pedido (max-rows), así
+            # que se sigue pidiendo hasta completar el lote o agotar los resultados
+            rows = query.execute().data
+            if not rows:
+                break
+            
+            batch.extend(rows)
+            last_cod_infotel = rows[-1]['cod_infotel']
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        
+        if batch:
+            yield batch
+
     def get_record_count(self) -> int:
         """Gets total number of records in the sociedades table."""
-        # Usando API de Supabase para contar
-        response = self.supabase.table('sociedades').select('*', count='exact').execute()
-        return response.count if hasattr(response, 'count') else 0
+        return self.count_records()
+    
+    def count_records(self, processed: Optional[bool] = None) -> int:
+        """
+        Cuenta las filas de sociedades (opcionalmente filtradas por processed) con
+        count='exact', pidiendo una sola fila en lugar de descargar la tabla
+        """
+        query = self.supabase.table('sociedades').select('cod_infotel', count='exact')
+        if processed is not None:
+            query = query.eq('processed', processed)
+        response = query.limit(1).execute()
+        return getattr(response, 'count', None) or 0
     
     def create_table_if_not_exists(self):
         # En Supabase, no podemos crear tablas a través de la API directamente
@@ -241,36 +314,103 @@ class SupabaseDatabaseManager:
         print("Nota: La creación de tablas en Supabase debe realizarse desde la interfaz de Supabase SQL Editor")
         pass
             
+    def _build_update_records(self, results: List[Dict[str, Any]], worker_id: str = None) -> List[Dict[str, Any]]:
+        """
+        Construye los datos de actualización de todos los resultados de una vez,
+        extrayendo teléfonos y redes sociales como columnas en lugar de fila a fila
+        """
+        rdf = pd.json_normalize(results, sep='_')
+        social_columns = [f'social_media_{network}' for network in SOCIAL_NETWORKS]
+        rdf = rdf.reindex(columns=rdf.columns.union(
+            ['cod_infotel', 'phones'] + list(UPDATE_DEFAULTS) + social_columns,
+            sort=False
+        ))
+
+        # Descartar resultados sin cod_infotel
+        rdf = rdf[rdf['cod_infotel'].notna() & rdf['cod_infotel'].astype(bool)]
+        if rdf.empty:
+            return []
+
+        # Campos que cada resultado trae de verdad: como con result.get(campo, defecto), el
+        # valor por defecto solo cubre los que faltan y un None explícito se guarda como NULL
+        present = pd.DataFrame(
+            [
+                [column in result for column in UPDATE_DEFAULTS]
+                + [network in (result.get('social_media') or {}) for network in SOCIAL_NETWORKS]
+                for result in results
+            ],
+            columns=list(UPDATE_DEFAULTS) + social_columns
+        ).loc[rdf.index]
+
+        update_df = pd.DataFrame({'cod_infotel': rdf['cod_infotel'].astype(int)})
+        for column, default in UPDATE_DEFAULTS.items():
+            with pd.option_context('future.no_silent_downcasting', True):
+                values = rdf[column].fillna(default).infer_objects(copy=False)
+            if column == 'url_status':
+                values = values.astype(int)
+            explicit_null = rdf[column].isna() & present[column]
+            if explicit_null.any():
+                values = values.astype(object).mask(explicit_null, None)
+            update_df[column] = values
+
+        phones = rdf['phones'].astype(object)
+        for i in range(3):
+            update_df[f'telefono_{i + 1}'] = phones.str[i].fillna('')
+
+        for network, column in zip(SOCIAL_NETWORKS, social_columns):
+            explicit_null = rdf[column].isna() & present[column]
+            update_df[network] = rdf[column].fillna('').astype(object).mask(explicit_null, None)
+
+        update_df = update_df.rename(columns={'is_ecommerce': 'e_commerce'})
+        update_df['worker_id'] = worker_id
+        update_df['processed'] = True
+
+        return update_df.to_dict('records')
+
     def update_scraping_results(self, results: List[Dict[str, Any]], worker_id: str = None) -> Dict[str, Any]:
-        """Actualiza los resultados de scraping"""
+        """
+        Actualiza los resultados de scraping de todo el lote en dos peticiones a Supabase:
+        una para saber qué empresas existen y un upsert por cod_infotel con todas ellas.
+        Si el upsert falla se reintenta empresa a empresa
+        """
+        records = self._build_update_records(results, worker_id)
+        if not records:
+            return {"status": "success", "updated": 0}
+        
+        try:
+            # El upsert insertaría las empresas que no existan: solo se envían las que sí
+            ids = [record['cod_infotel'] for record in records]
+            existing = self.supabase.table('sociedades') \
+                .select('cod_infotel') \
+                .in_('cod_infotel', ids) \
+                .execute()
+            existing_ids = {row['cod_infotel'] for row in existing.data or []}
+            for cod_infotel in ids:
+                if cod_infotel not in existing_ids:
+                    print(f"⚠️ No se actualizó la empresa {cod_infotel}")
+            records = [record for record in records if record['cod_infotel'] in existing_ids]
+            if not records:
+                return {"status": "success", "updated": 0}
+            
+            response = self.supabase.table('sociedades') \
+                .upsert(records, on_conflict='cod_infotel') \
+                .execute()
+            updated = len(response.data or [])
+            print(f"✅ {updated} empresas actualizadas en un único upsert")
+            return {"status": "success", "updated": updated}
+        except Exception as e:
+            print(f"❌ Error en el upsert de {len(records)} empresas, se reintenta una a una: {str(e)}")
+        
+        return self._update_records_one_by_one(records)
+
+    def _update_records_one_by_one(self, records: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Actualiza las empresas con un update().eq() por fila"""
         updated_companies = []
         
-        for result in results:
+        for update_data in records:
+            update_data = dict(update_data)
+            cod_infotel = update_data.pop('cod_infotel')
             try:
-                cod_infotel = result.get('cod_infotel')
-                if not cod_infotel:
-                    continue
-                
-                # Preparar datos para actualización
-                update_data = {
-                    'url_exists': result.get('url_exists', False),
-                    'url_valida': result.get('url_valida', ''),
-                    'url_limpia': result.get('url_limpia', ''),
-                    'url_status': result.get('url_status', -1),
-                    'url_status_mensaje': result.get('url_status_mensaje', ''),
-                    'telefono_1': result.get('phones', ['', '', ''])[0] if result.get('phones') else '',
-                    'telefono_2': result.get('phones', ['', '', ''])[1] if result.get('phones') and len(result.get('phones')) > 1 else '',
-                    'telefono_3': result.get('phones', ['', '', ''])[2] if result.get('phones') and len(result.get('phones')) > 2 else '',
-                    'facebook': result.get('social_media', {}).get('facebook', ''),
-                    'twitter': result.get('social_media', {}).get('twitter', ''),
-                    'linkedin': result.get('social_media', {}).get('linkedin', ''),
-                    'instagram': result.get('social_media', {}).get('instagram', ''),
-                    'youtube': result.get('social_media', {}).get('youtube', ''),
-                    'e_commerce': result.get('is_ecommerce', False),
-                    'worker_id': worker_id,
-                    'processed': True
-                }
-                
                 # Actualizar usando la API de Supabase
                 response = self.supabase.table('sociedades').update(update_data).eq('cod_infotel', cod_infotel).execute()
                 
@@ -281,7 +421,7 @@ class SupabaseDatabaseManager:
                     print(f"⚠️ No se actualizó la empresa {cod_infotel}")
                     
             except Exception as e:
-                print(f"❌ Error actualizando empresa {result.get('cod_infotel')}: {str(e)}")
+                print(f"❌ Error actualizando empresa {cod_infotel}: {str(e)}")
                 continue
         
-        return {"status": "success", "updated": len(updated_companies)}
\ No newline at end of file
+        return {"status": "success", "updated": len(updated_companies)}
@@ -1,10 +1,127 @@
 # validators/data_validator.py
 
+import os
+import json
+import time
+import numpy as np
 import pandas as pd
 import re
-from urllib.parse import urlparse
+import redis
 import requests
-from typing import Tuple
+import threading
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+from redis_config import (
+    REDIS_URL_STATUS_CACHE,
+    URL_STATUS_CACHE_TTL,
+    REDIS_CACHE_SOCKET_TIMEOUT,
+)
+from task_manager import get_connection_pool
+
+# Número de comprobaciones HEAD simultáneas al validar URLs
+URL_STATUS_MAX_WORKERS = 64
+
+# Extrae el dominio (host[:puerto]) de una URL con o sin esquema
+URL_DOMAIN_RE = re.compile(r'^(?:https?://)?([^/\s?#]+)', re.IGNORECASE)
+
+# Sesión compartida por todas las comprobaciones HEAD: reutiliza conexiones (y el
+# handshake TLS) entre peticiones al mismo host, con un pool por hilo del ejecutor
+HEAD_SESSION = requests.Session()
+_head_adapter = HTTPAdapter(
+    pool_connections=URL_STATUS_MAX_WORKERS,
+    pool_maxsize=URL_STATUS_MAX_WORKERS,
+    max_retries=0
+)
+HEAD_SESSION.mount('http://', _head_adapter)
+HEAD_SESSION.mount('https://', _head_adapter)
+
+# Estados HTTP ya comprobados en este proceso (solo respuestas reales, no errores de red)
+URL_STATUS_MEMO_SIZE = 100000
+_url_status_memo: Dict[str, int] = {}
+_url_status_memo_lock = threading.Lock()
+
+def check_url_status(url: str) -> int:
+    """
+    Verifica el estado de una URL.
+    Las respuestas HTTP se memorizan por dominio para no repetir la petición en el mismo
+    proceso; los errores de red (-1) pueden ser transitorios y se vuelven a comprobar.
+    """
+    if url is None:
+        return None
+    with _url_status_memo_lock:
+        status = _url_status_memo.get(url)
+    if status is not None:
+        return status
+    
+    try:
+        response = HEAD_SESSION.head(
+            f'http://{url}' if not url.startswith(('http://', 'https://')) else url,
+            timeout=5,
+            allow_redirects=True
+        )
+    except requests.RequestException:
+        return -1
+    
+    status = response.status_code
+    with _url_status_memo_lock:
+        # Memo acotado: al llenarse se descarta la entrada más antigua
+        if len(_url_status_memo) >= URL_STATUS_MEMO_SIZE:
+            del _url_status_memo[next(iter(_url_status_memo))]
+        _url_status_memo[url] = status
+    return status
+
+@lru_cache(maxsize=1)
+def _get_status_cache() -> Optional[redis.Redis]:
+    """Cliente Redis para la caché de estados de URL (None si Redis no está configurado)"""
+    if not os.getenv('REDIS_HOST'):
+        return None
+    return redis.Redis(connection_pool=get_connection_pool(
+        'url_status_cache',
+        socket_timeout=REDIS_CACHE_SOCKET_TIMEOUT,
+    ))
+
+def get_cached_url_statuses(domains: list) -> Dict[str, int]:
+    """
+    Devuelve los estados guardados en Redis en las últimas URL_STATUS_CACHE_TTL
+    segundos para los dominios indicados, en una sola consulta HMGET
+    """
+    cache = _get_status_cache()
+    if cache is None or not domains:
+        return {}
+    try:
+        entries = cache.hmget(REDIS_URL_STATUS_CACHE, domains)
+    except redis.RedisError:
+        return {}
+    
+    now = time.time()
+    cached = {}
+    for domain, entry in zip(domains, entries):
+        if entry:
+            entry = json.loads(entry)
+            if now - entry['checked_at'] < URL_STATUS_CACHE_TTL:
+                cached[domain] = entry['status']
+    return cached
+
+def save_url_statuses(statuses: Dict[str, int]):
+    """
+    Guarda en Redis los estados comprobados (salvo los errores de red, que
+    pueden ser transitorios) para que otras ejecuciones no repitan la petición
+    """
+    cache = _get_status_cache()
+    checked_at = time.time()
+    mapping = {
+        domain: json.dumps({"status": status, "checked_at": checked_at})
+        for domain, status in statuses.items()
+        if status is not None and status != -1
+    }
+    if cache is None or not mapping:
+        return
+    try:
+        cache.hset(REDIS_URL_STATUS_CACHE, mapping=mapping)
+    except redis.RedisError:
+        pass
 
 class DataValidator:
     @staticmethod
@@ -12,24 +129,37 @@ class DataValidator:
         """
         Limpia espacios en blanco al inicio y final de todas las columnas de texto.
         """
-        df = df.map(lambda x: x.strip() if isinstance(x, str) else x)
+        # Las columnas limpias se devuelven en un DataFrame nuevo, sin tocar el del llamante
+        cleaned = {}
+        for column in df.select_dtypes(include=['object', 'string']).columns:
+            try:
+                stripped = df[column].str.strip()
+            except AttributeError:
+                # Columna sin ningún valor de texto
+                continue
+            # Conservar tal cual los valores que no son texto (None, números...)
+            cleaned[column] = stripped.where(stripped.notna(), df[column])
 
-        return df
+        return df.assign(**cleaned)
         
     @staticmethod
     def validate_cod_infotel(df: pd.DataFrame) -> Tuple[bool, str]:
         """
         Valida que COD_INFOTEL sean valores únicos y no contenga nulos
         """
+        cod_infotel = df['cod_infotel']
+
+        # Una sola tabla hash para nulos y duplicados: los nulos reciben el código -1
+        codes, uniques = pd.factorize(cod_infotel)
+
         # Verificar nulos
-        null_count = df['cod_infotel'].isnull().sum()
+        null_count = int((codes == -1).sum())
         if null_count > 0:
             return False, f"Existen {null_count} valores nulos en COD_INFOTEL"
             
-        # Verificar duplicados
-        duplicates = df[df.duplicated(['cod_infotel'])]
-        if not duplicates.empty:
-            duplicate_values = duplicates['cod_infotel'].tolist()
+        # Verificar duplicados (la lista solo se construye si la validación falla)
+        if len(uniques) != len(codes):
+            duplicate_values = cod_infotel[cod_infotel.duplicated()].tolist()
             return False, f"Valores duplicados en COD_INFOTEL: {duplicate_values}"
             
         return True, "Validación de COD_INFOTEL correcta"
@@ -39,8 +169,17 @@ class DataValidator:
         """
         Asegura que los códigos postales tengan 5 dígitos
         """
-        df['cod_postal'] = df['cod_postal'].astype(str)
-        df['cod_postal'] = df['cod_postal'].apply(lambda x: x.zfill(5) if x.isdigit() else x)
+        # Columna entera sin nulos: formatear solo los valores distintos (unos pocos miles)
+        if pd.api.types.is_integer_dtype(df['cod_postal']) and not df['cod_postal'].hasnans:
+            codes, uniques = pd.factorize(df['cod_postal'])
+            formatted = np.array([f"{value:05d}" for value in uniques], dtype=object)
+            df['cod_postal'] = pd.Series(formatted[codes], index=df.index)
+            return df
+        
+        postal_codes = df['cod_postal'].astype(str)
+        numeric = postal_codes.str.isdigit()
+        postal_codes[numeric] = postal_codes[numeric].str.zfill(5)
+        df['cod_postal'] = postal_codes
         return df
 
     @staticmethod
@@ -49,46 +188,31 @@ class DataValidator:
         Valida y limpia URLs, creando las columnas requeridas.
         URLs vacías o con solo espacios en blanco se convierten en None
         """
-        def clean_url(url: str) -> str:
-            """Extrae el dominio de una URL"""
-            if pd.isna(url):
-                return None
-            # Limpiar espacios en blanco
-            url = str(url).strip()
-            if url == '':
-                return None
-            try:
-                parsed = urlparse(url if url.startswith(('http://', 'https://')) else f'http://{url}')
-                domain = parsed.netloc
-                return domain if domain else None
-            except:
-                return None
-
-        def check_url_status(url: str) -> int:
-            """Verifica el estado de una URL"""
-            if url is None:
-                return None
-            try:
-                response = requests.head(
-                    f'http://{url}' if not url.startswith(('http://', 'https://')) else url,
-                    timeout=5,
-                    allow_redirects=True
-                )
-                return response.status_code
-            except requests.RequestException:
-                return -1
-
-        # Limpiar la columna URL original
-        df['url'] = df['url'].apply(lambda x: None if pd.isna(x) or str(x).strip() == '' else str(x).strip())
+        # Limpiar la columna URL original (operaciones vectorizadas sobre la columna, sin .apply)
+        url = df['url'].astype(object)
+        stripped = url.astype(str).str.strip()
+        url = stripped.where(url.notna() & (stripped != ''), None)
+        df['url'] = url
         
         # Crear columna URL_EXISTS
-        df['url_exists'] = df['url'].apply(lambda x: False if x is None else True)
+        df['url_exists'] = url.notna()
         
         # Crear columna URL_LIMPIA
-        df['url_limpia'] = df['url'].apply(clean_url)
+        # (una sola pasada de regex sobre toda la columna)
+        url_limpia = url.str.extract(URL_DOMAIN_RE, expand=False)
+        df['url_limpia'] = url_limpia.where(url_limpia.notna(), None)
         
-        # Crear columna URL_STATUS
-        df['url_status'] = df['url_limpia'].apply(check_url_status)
+        # Crear columna URL_STATUS comprobando cada dominio distinto una sola vez y en paralelo,
+        # saltando los que ya tienen un estado reciente en la caché de Redis
+        unique_urls = df['url_limpia'].dropna().unique().tolist()
+        statuses = get_cached_url_statuses(unique_urls)
+        pending_urls = [url for url in unique_urls if url not in statuses]
+        with ThreadPoolExecutor(max_workers=URL_STATUS_MAX_WORKERS) as executor:
+            probed = dict(zip(pending_urls, executor.map(check_url_status, pending_urls)))
+        save_url_statuses(probed)
+        statuses.update(probed)
+        url_status = df['url_limpia'].map(pd.Series(statuses, dtype=object)).astype(object)
+        df['url_status'] = url_status.where(url_status.notna(), None)
         
         return df
 
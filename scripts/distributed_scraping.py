@@ -5,9 +5,10 @@ import socket
 import json
 from typing import Dict, Any, List, Optional, Tuple
 import traceback
+from collections import deque
 
 # Importaciones del sistema original
-from scraping_flow import WebScrapingService, RateLimiter
+from scraping_flow import WebScrapingService
 from task_manager import TaskManager
 from database_supabase import SupabaseDatabaseManager
 # En vez de usar DB_CONFIG de config.py, usaremos la configuración de Supabase
@@ -17,6 +18,12 @@ from supabase_config import SUPABASE_DB_CONFIG
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Número de tareas que se piden a Redis en cada viaje
+TASK_FETCH_BATCH_SIZE = 32
+
+# Segundos que el worker espera bloqueado en Redis a que llegue una tarea
+TASK_WAIT_TIMEOUT = 5
+
 class DistributedWebScrapingService:
     """
     Servicio de scraping distribuido usando Redis para coordinación
@@ -39,22 +46,89 @@ class DistributedWebScrapingService:
         # Usamos SUPABASE_DB_CONFIG en lugar de DB_CONFIG
         self.scraper = WebScrapingService(SUPABASE_DB_CONFIG)
         
+        # Resultados del lote en curso pendientes de escribir en Supabase y de cerrar en Redis
+        self._pending_updates = []
+        self._pending_completions = []
+        
+        # Tareas del lote en curso reservadas en Redis que aún no se han empezado
+        self._unstarted_tasks = deque()
+        
         logger.info(f"DistributedWebScrapingService inicializado con worker ID: {self.worker_id}")
 
-    def process_next_task(self) -> Dict[str, Any]:
+    def flush_updates(self) -> int:
+        """
+        Escribe en Supabase los resultados acumulados y cierra en Redis las tareas
+        correspondientes
+        
+        Returns:
+            int: Número de tareas cerradas
+        """
+        if not self._pending_completions:
+            return 0
+        
+        updates, self._pending_updates = self._pending_updates, []
+        completions, self._pending_completions = self._pending_completions, []
+        
+        # Primero la base de datos y después Redis, para no dar por cerrada una tarea sin guardar
+        if updates:
+            self.db.update_scraping_results(updates, worker_id=self.worker_id)
+            logger.info(f"Enviados {len(updates)} resultados a Supabase")
+        self.task_manager.complete_tasks(completions)
+        return len(completions)
+
+    def release_unstarted_tasks(self) -> int:
+        """
+        Devuelve a la cola de pendientes las tareas del lote que no se llegaron a procesar
+        
+        Returns:
+            int: Número de tareas devueltas
+        """
+        tasks = list(self._unstarted_tasks)
+        self._unstarted_tasks.clear()
+        self.task_manager.release_tasks(tasks)
+        return len(tasks)
+
+    def process_next_batch(self, n: int = TASK_FETCH_BATCH_SIZE) -> Dict[str, Any]:
         """
-        Obtiene y procesa la siguiente tarea de la cola de Redis
+        Obtiene hasta n tareas de una vez, las procesa y escribe todos sus
+        resultados en Supabase y Redis en un único envío al final del lote
+        
+        Args:
+            n: Número máximo de tareas del lote
         
         Returns:
-            Dict: Información sobre el resultado del procesamiento
+            Dict: Resumen del lote (tareas procesadas y su desglose por estado)
         """
-        # Obtener tarea de Redis
-        task = self.task_manager.get_next_task()
+        tasks = self.task_manager.get_next_tasks(n)
+        if not tasks:
+            # Cola vacía: esperar bloqueado a que llegue alguna tarea
+            tasks = self.task_manager.get_next_tasks(n, timeout=TASK_WAIT_TIMEOUT)
         
-        if not task:
+        if not tasks:
             logger.info("No hay tareas pendientes en la cola")
             return {"status": "no_tasks"}
         
+        self._unstarted_tasks.extend(tasks)
+        statuses = []
+        while self._unstarted_tasks:
+            # Se saca del lote al terminar: si se interrumpe a mitad, también vuelve a pending
+            statuses.append(self._process_task(self._unstarted_tasks[0])["status"])
+            self._unstarted_tasks.popleft()
+        self.flush_updates()
+        
+        return {
+            "status": "batch",
+            "processed": len(tasks),
+            "success": statuses.count("success"),
+            "failed": statuses.count("failed"),
+            "error": statuses.count("error")
+        }
+
+    def _process_task(self, task) -> Dict[str, Any]:
+        """
+        Procesa una tarea y deja su actualización y su cierre en los buffers
+        pendientes de enviar (ver flush_updates)
+        """
         try:
             # Extraer los datos de la empresa
             company_data = task.get('company_data', {})
@@ -70,15 +144,9 @@ class DistributedWebScrapingService:
                 # Agregar worker_id a los resultados
                 result['worker_id'] = self.worker_id
                 
-                # Actualizar en Supabase
-                update_result = self.db.update_scraping_results([result], worker_id=self.worker_id)
-                
-                # Marcar tarea como completada en Redis
-                self.task_manager.complete_task(
-                    task, 
-                    success=True, 
-                    result=result
-                )
+                # Encolar la actualización para Supabase y el cierre de la tarea en Redis
+                self._pending_updates.append(result)
+                self._pending_completions.append({"task": task, "success": True, "result": result})
                 
                 return {
                     "status": "success",
@@ -97,15 +165,13 @@ class DistributedWebScrapingService:
                     'processed': True
                 }
                 
-                # Actualizar en Supabase
-                self.db.update_scraping_results([empty_data], worker_id=self.worker_id)
-                
-                # Marcar tarea como fallida en Redis
-                self.task_manager.complete_task(
-                    task, 
-                    success=False, 
-                    error=result.get('url_status_mensaje', 'URL no válida')
-                )
+                # Encolar la actualización para Supabase y el cierre de la tarea en Redis
+                self._pending_updates.append(empty_data)
+                self._pending_completions.append({
+                    "task": task,
+                    "success": False,
+                    "error": result.get('url_status_mensaje', 'URL no válida')
+                })
                 
                 return {
                     "status": "failed",
@@ -118,12 +184,8 @@ class DistributedWebScrapingService:
             logger.error(f"Error procesando tarea {task.get('task_id')}: {str(e)}")
             traceback.print_exc()
             
-            # Marcar tarea como fallida en Redis
-            self.task_manager.complete_task(
-                task, 
-                success=False, 
-                error=str(e)
-            )
+            # Marcar tarea como fallida en Redis (al cerrar el lote)
+            self._pending_completions.append({"task": task, "success": False, "error": str(e)})
             
             return {
                 "status": "error",
@@ -151,8 +213,11 @@ class DistributedWebScrapingService:
                     logger.info(f"Se alcanzó el límite de tareas: {max_tasks}")
                     break
                 
-                # Procesar siguiente tarea
-                result = self.process_next_task()
+                # Procesar el siguiente lote (sin reservar más tareas de las que quedan por hacer)
+                batch_size = TASK_FETCH_BATCH_SIZE
+                if max_tasks:
+                    batch_size = min(batch_size, max_tasks - tasks_processed)
+                result = self.process_next_batch(batch_size)
                 
                 if result["status"] == "no_tasks":
                     # No hay tareas, verificar timeout
@@ -166,19 +231,19 @@ class DistributedWebScrapingService:
                         logger.info(f"Tiempo de espera superado después de {idle_time:.1f} segundos")
                         break
                     
-                    # Esperar un poco para no saturar Redis
-                    time.sleep(5)
-                    
                     # Mostrar estadísticas periódicamente
                     if int(idle_time) % 30 == 0:  # Cada 30 segundos
                         stats = self.task_manager.get_queue_stats()
                         logger.info(f"Estadísticas de cola: {stats}")
                 else:
-                    # Tarea procesada, reiniciar contador de tiempo inactivo
+                    # Lote procesado, reiniciar contador de tiempo inactivo
                     idle_since = None
-                    tasks_processed += 1
+                    tasks_processed += result["processed"]
                     
-                    logger.info(f"Tarea procesada: {result['status']}. Total: {tasks_processed}")
+                    logger.info(
+                        f"Lote procesado: {result['success']} con éxito, {result['failed']} fallidas, "
+                        f"{result['error']} con error. Total: {tasks_processed}"
+                    )
         
         except KeyboardInterrupt:
             logger.info("Worker detenido por el usuario")
@@ -188,6 +253,18 @@ class DistributedWebScrapingService:
             traceback.print_exc()
         
         finally:
+            # Escribir los resultados que queden en el buffer
+            try:
+                self.flush_updates()
+            except Exception as e:
+                logger.error(f"Error enviando resultados pendientes: {str(e)}")
+            # Devolver a pending las tareas reservadas que no se llegaron a empezar
+            try:
+                self.release_unstarted_tasks()
+            except Exception as e:
+                logger.error(f"Error devolviendo tareas sin procesar: {str(e)}")
+            self.scraper.close()
+            
             logger.info(f"Worker finalizado. Tareas procesadas: {tasks_processed}")
             return tasks_processed
 
@@ -213,15 +290,13 @@ def enqueue_companies(limit=100, reset_queues=False):
         LIMIT %s
     """
     
-    companies_df = db.execute_query(query, params=(limit,), return_df=True)
+    # Las filas llegan directamente como diccionarios, sin pasar por un DataFrame
+    companies = db.execute_query_dicts(query, params=(limit,))
     
-    if companies_df is None or companies_df.empty:
+    if not companies:
         logger.warning("No se encontraron empresas para procesar")
         return 0
     
-    # Convertir a lista de diccionarios
-    companies = companies_df.to_dict('records')
-    
     # Encolar empresas
     enqueued = task_manager.enqueue_tasks(companies)
     logger.info(f"Se encolaron {enqueued} empresas para procesamiento")
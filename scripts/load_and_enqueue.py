@@ -1,7 +1,8 @@
 import argparse
 import pandas as pd
-import numpy as np
 import logging
+import pyarrow as pa
+from pyarrow import csv as pacsv
 from task_manager import TaskManager
 from database_supabase import SupabaseDatabaseManager
 
@@ -12,7 +13,46 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def load_and_enqueue(file_path, batch_size=1000, reset_queues=False):
+# Columnas que se guardan y encolan; el resto del fichero no se llega a parsear
+LOAD_COLUMNS = [
+    'cod_infotel', 'nif', 'razon_social', 'domicilio', 'cod_postal',
+    'nom_poblacion', 'nom_provincia', 'url'
+]
+
+def read_companies_file(file_path):
+    """
+    Lee del CSV/Excel solo las columnas de LOAD_COLUMNS, con los nombres normalizados.
+    Los CSV se leen con el lector multihilo de pyarrow proyectando esas columnas
+    """
+    if file_path.endswith('.csv'):
+        parse_options = pacsv.ParseOptions(delimiter=';')
+        
+        # Los nombres del fichero pueden venir en mayúsculas o con espacios:
+        # leer la cabecera y quedarse con los que corresponden a LOAD_COLUMNS
+        file_columns = pacsv.open_csv(file_path, parse_options=parse_options).schema.names
+        selected = [name for name in file_columns if name.strip().lower() in LOAD_COLUMNS]
+        
+        # Todo como texto salvo cod_infotel (así no se pierden ceros en códigos postales o NIF)
+        column_types = {name: pa.string() for name in selected if name.strip().lower() != 'cod_infotel'}
+        
+        table = pacsv.read_csv(
+            file_path,
+            parse_options=parse_options,
+            convert_options=pacsv.ConvertOptions(
+                include_columns=selected,
+                column_types=column_types,
+                strings_can_be_null=True
+            )
+        )
+        df = table.to_pandas()
+    else:
+        df = pd.read_excel(file_path, usecols=lambda column: str(column).strip().lower() in LOAD_COLUMNS)
+    
+    # Normalizar nombres de columnas
+    df.columns = df.columns.str.strip().str.lower()
+    return df
+
+def load_and_enqueue(file_path, batch_size=10000, reset_queues=False):
     """
     Carga datos desde un archivo CSV/Excel y los encola en Redis
     """
@@ -27,17 +67,17 @@ def load_and_enqueue(file_path, batch_size=1000, reset_queues=False):
     
     # Cargar archivo
     logger.info(f"Loading file: {file_path}")
-    if file_path.endswith('.csv'):
-        df = pd.read_csv(file_path, sep=';', encoding='utf-8')
-    else:
-        df = pd.read_excel(file_path)
+    df = read_companies_file(file_path)
     
-    # Normalizar nombres de columnas
-    df.columns = df.columns.str.strip().str.lower()
-    
-    # Limpiar datos
-    df = df.replace(r'^\s*$', np.nan, regex=True)
-    df = df.replace({np.nan: None})
+    # Limpiar datos: celdas vacías o solo con espacios -> None
+    # (el lector ya trae las vacías como nulos; solo hay que revisar las columnas de texto)
+    for column in df.select_dtypes(include='object').columns:
+        try:
+            blank = df[column].str.strip().eq('')
+        except AttributeError:
+            continue
+        df[column] = df[column].mask(blank)
+    df = df.astype(object).where(df.notna(), None)
     
     # Guardar en base de datos
     logger.info(f"Saving {len(df)} records to database")
@@ -49,29 +89,18 @@ def load_and_enqueue(file_path, batch_size=1000, reset_queues=False):
         logger.error(f"Error saving to database: {result.get('message')}")
         return
     
-    # Obtener empresas no procesadas
+    # Obtener empresas no procesadas y encolarlas a medida que llegan los lotes,
+    # sin cargar todo el resultado en memoria
     logger.info("Getting companies to process")
-    companies = db.execute_query(
-        "SELECT cod_infotel, nif, razon_social, domicilio, cod_postal, nom_poblacion, nom_provincia, url " +
-        "FROM sociedades WHERE processed = FALSE OR processed IS NULL",
-        return_df=True
-    )
-    
-    if companies is None or len(companies) == 0:
-        logger.warning("No companies to process")
-        return
-    
-    # Convertir a lista de diccionarios
-    companies_list = companies.to_dict('records')
-    logger.info(f"Found {len(companies_list)} companies to process")
-    
-    # Encolar en lotes
     total_enqueued = 0
-    for i in range(0, len(companies_list), batch_size):
-        batch = companies_list[i:i+batch_size]
+    for batch_number, batch in enumerate(db.iter_companies_to_process(batch_size), start=1):
         enqueued = task_manager.enqueue_tasks(batch)
         total_enqueued += enqueued
-        logger.info(f"Enqueued batch {i//batch_size + 1}/{(len(companies_list)-1)//batch_size + 1} ({enqueued} tasks)")
+        logger.info(f"Enqueued batch {batch_number} ({enqueued} tasks)")
+    
+    if total_enqueued == 0:
+        logger.warning("No companies to process")
+        return
     
     # Mostrar estadísticas finales
     stats = task_manager.get_queue_stats()
@@ -87,8 +116,8 @@ def main():
     parser.add_argument(
         "--batch-size", 
         type=int, 
-        default=1000,
-        help="Batch size for enqueueing (default: 1000)"
+        default=10000,
+        help="Batch size for enqueueing (default: 10000)"
     )
     parser.add_argument(
         "--reset", 
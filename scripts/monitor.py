@@ -4,16 +4,25 @@ import time
 import time
 import argparse
 import logging
-import json
+import numpy as np
+import orjson
 import os
+import queue
+import threading
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from rich.console import Console
 from rich.table import Table
 from rich.live import Live
 from rich.panel import Panel
 from rich.progress import Progress, BarColumn, TextColumn
+from rich.text import Text
 from task_manager import TaskManager
 from database_supabase import SupabaseDatabaseManager
+from redis_config import REDIS_EVENTS_CHANNEL
+
+# Sin eventos en las colas, el monitor se refresca igualmente cada este número de segundos
+MONITOR_FALLBACK_REFRESH = 30
 
 # Configurar logging
 logging.basicConfig(
@@ -32,6 +41,7 @@ class ScrapingMonitor:
         self.db = SupabaseDatabaseManager()
         self.console = Console()
         self.start_time = time.time()
+        self.build_view()
     
     def get_active_workers(self):
         """Obtiene la lista de workers activos en los últimos 5 minutos"""
@@ -52,31 +62,21 @@ class ScrapingMonitor:
     
     def get_recent_errors(self, limit=10):
         """Obtiene los errores recientes de Redis"""
-        errors = []
-        for i in range(limit):
-            error = self.task_manager.redis.lindex(f"scraper:metrics:errors", i)
-            if error:
-                errors.append(error)
-            else:
-                break
-        return errors
+        # Un solo LRANGE acotado en lugar de un LINDEX por elemento
+        return self.task_manager.redis.lrange("scraper:metrics:errors", 0, limit - 1)
     
     def get_metrics(self):
         """Obtiene métricas de rendimiento"""
         # Obtener tiempos de procesamiento recientes
-        processing_times = []
-        for i in range(100):  # Últimos 100
-            time_str = self.task_manager.redis.lindex(f"scraper:metrics:processing_times", i)
-            if time_str:
-                processing_times.append(float(time_str))
-            else:
-                break
+        raw_times = self.task_manager.redis.lrange("scraper:metrics:processing_times", 0, 99)  # Últimos 100
+        # Conversión y estadísticas en una sola pasada de numpy, sin un float() por elemento
+        processing_times = np.array(raw_times, dtype=np.float64)
         
         # Calcular estadísticas básicas
-        if processing_times:
-            avg_time = sum(processing_times) / len(processing_times)
-            min_time = min(processing_times)
-            max_time = max(processing_times)
+        if processing_times.size:
+            avg_time = float(processing_times.mean())
+            min_time = float(processing_times.min())
+            max_time = float(processing_times.max())
         else:
             avg_time = min_time = max_time = 0
         
@@ -122,17 +122,18 @@ class ScrapingMonitor:
             'worker_stats': worker_stats
         }
     
-    def get_progress_data(self):
+    def get_progress_data(self, queue_stats=None):
         """Obtiene datos para la barra de progreso"""
-        # Obtener estadísticas de las colas
-        queue_stats = self.task_manager.get_queue_stats()
+        # Obtener estadísticas de las colas (si no se reciben ya leídas)
+        if queue_stats is None:
+            queue_stats = self.task_manager.get_queue_stats()
         
-        # Obtener total de empresas
-        total_query = "SELECT COUNT(*) FROM sociedades"
-        processed_query = "SELECT COUNT(*) FROM sociedades WHERE processed = TRUE"
-        
-        total = self.db.execute_query(total_query)
-        processed = self.db.execute_query(processed_query)
+        # Obtener total de empresas y procesadas: dos conteos exactos en paralelo
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            total_future = executor.submit(self.db.count_records)
+            processed_future = executor.submit(self.db.count_records, True)
+            total = total_future.result()
+            processed = processed_future.result()
         
         # Calcular progreso
         progress = (processed / total) * 100 if total > 0 else 0
@@ -167,70 +168,178 @@ class ScrapingMonitor:
             'rate': rate
         }
     
-    def run(self, refresh_rate=5, output_file=None):
-        """Ejecuta el monitor con actualización en tiempo real"""
+    def wait_for_events(self, pubsub, timeout):
+        """
+        Espera bloqueado hasta recibir un evento de las colas o hasta que pase timeout.
+        Devuelve True si llegó algún evento (y descarta los acumulados)
+        """
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            if pubsub.get_message(timeout=remaining):
+                while pubsub.get_message():
+                    pass
+                return True
+    
+    def collect_snapshot(self, executor):
+        """Obtiene de una vez todos los datos que muestra el monitor"""
+        # Las consultas a Redis y Supabase son independientes,
+        # así que se lanzan a la vez en lugar de encadenar sus viajes de red
+        workers_future = executor.submit(self.get_active_workers)
+        metrics_future = executor.submit(self.get_metrics)
+        errors_future = executor.submit(self.get_recent_errors)
+        queue_stats = self.task_manager.get_queue_stats()
+        progress_data = self.get_progress_data(queue_stats)
+        return {
+            'queue_stats': queue_stats,
+            'progress': progress_data,
+            'workers': workers_future.result(),
+            'metrics': metrics_future.result(),
+            'errors': errors_future.result()
+        }
+    
+    @staticmethod
+    def publish_snapshot(data_q, snapshot):
+        """Deja snapshot en data_q, descartando la anterior si la interfaz aún no la ha pintado"""
         try:
-            with Live(refresh_per_second=1/refresh_rate) as live:
-                while True:
-                    # Obtener datos
-                    queue_stats = self.task_manager.get_queue_stats()
-                    workers = self.get_active_workers()
-                    progress_data = self.get_progress_data()
-                    metrics = self.get_metrics()
-                    errors = self.get_recent_errors()
-                    
-                    # Crear tabla de estadísticas
-                    stats_table = Table(title="Estado de las Colas")
-                    stats_table.add_column("Cola")
-                    stats_table.add_column("Cantidad")
-                    stats_table.add_column("Porcentaje")
-                    
-                    total_tasks = sum(queue_stats.values())
-                    
-                    for queue, count in queue_stats.items():
-                        percent = f"{count/total_tasks*100:.1f}%" if total_tasks > 0 else "0%"
-                        stats_table.add_row(queue.capitalize(), str(count), percent)
-                    
-                    # Crear tabla de workers
-                    workers_table = Table(title=f"Workers Activos ({len(workers)})")
-                    workers_table.add_column("Worker ID")
-                    workers_table.add_column("Tareas")
-                    workers_table.add_column("Última Actualización")
-                    
-                    for worker in workers:
-                        # Formatear tiempo transcurrido desde la última actualización
-                        if isinstance(worker['last_update'], datetime):
-                            now = datetime.now()
-                            seconds = (now - worker['last_update']).total_seconds()
-                            if seconds < 60:
-                                time_ago = f"hace {seconds:.0f}s"
-                            else:
-                                time_ago = f"hace {seconds/60:.1f}m"
-                        else:
-                            time_ago = "desconocido"
-                            
-                        workers_table.add_row(
-                            worker['worker_id'],
-                            str(worker['tasks']),
-                            time_ago
-                        )
-                    
-                    # Crear barra de progreso
-                    progress = Progress(
-                        TextColumn("[bold blue]{task.description}"),
-                        BarColumn(),
-                        TextColumn("[progress.percentage]{task.percentage:>3.1f}%"),
-                        TextColumn("({task.completed}/{task.total})")
-                    )
-                    
-                    task = progress.add_task(
-                        "Progreso Total", 
-                        total=progress_data['total'],
-                        completed=progress_data['processed']
-                    )
-                    
-                    # Crear panel de métricas
-                    metrics_text = f"""
+            data_q.get_nowait()
+        except queue.Empty:
+            pass
+        data_q.put_nowait(snapshot)
+    
+    def collector_loop(self, data_q, refresh_rate):
+        """
+        Hilo de recogida de datos: deja en data_q la última instantánea disponible,
+        de modo que la interfaz nunca espera a las consultas. Los errores se envían
+        también a data_q ({'error': ...}) para que la interfaz los muestre
+        """
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            # Refrescar cuando TaskManager publique cambios en las colas, en lugar de sondear;
+            # la suscripción se rehace si se pierde la conexión con Redis
+            pubsub = None
+            
+            while True:
+                refresh_started = time.time()
+                try:
+                    self.publish_snapshot(data_q, self.collect_snapshot(executor))
+                except Exception as e:
+                    logger.error(f"Error obteniendo datos del monitor: {str(e)}")
+                    self.publish_snapshot(data_q, {'error': f"Error obteniendo datos: {str(e)}"})
+                
+                # Esperar a la próxima actualización: como mucho una cada refresh_rate
+                # segundos y, si no hay actividad, una cada MONITOR_FALLBACK_REFRESH
+                elapsed = time.time() - refresh_started
+                if elapsed < refresh_rate:
+                    time.sleep(refresh_rate - elapsed)
+                try:
+                    if pubsub is None:
+                        pubsub = self.task_manager.redis.pubsub(ignore_subscribe_messages=True)
+                        pubsub.subscribe(REDIS_EVENTS_CHANNEL)
+                    self.wait_for_events(pubsub, MONITOR_FALLBACK_REFRESH)
+                except Exception as e:
+                    logger.error(f"Error esperando eventos de Redis: {str(e)}")
+                    self.publish_snapshot(data_q, {'error': f"Sin conexión con Redis: {str(e)}"})
+                    if pubsub is not None:
+                        try:
+                            pubsub.close()
+                        except Exception:
+                            pass
+                        pubsub = None
+                    time.sleep(MONITOR_FALLBACK_REFRESH)
+    
+    def build_view(self):
+        """
+        Crea una sola vez la tabla de colas, la barra de progreso y los paneles del monitor;
+        en cada refresco solo se actualiza su contenido (salvo la tabla de workers)
+        """
+        # Tabla de estadísticas: una fila por cola con celdas Text que se reescriben
+        self.stats_table = Table(title="Estado de las Colas")
+        self.stats_table.add_column("Cola")
+        self.stats_table.add_column("Cantidad")
+        self.stats_table.add_column("Porcentaje")
+        self.stats_cells = {}
+        
+        # Tabla de workers: el número de filas varía, así que se rehace en cada refresco
+        self.workers_table = self.build_workers_table([])
+        
+        # Barra de progreso con una única tarea que se actualiza
+        self.progress = Progress(
+            TextColumn("[bold blue]{task.description}"),
+            BarColumn(),
+            TextColumn("[progress.percentage]{task.percentage:>3.1f}%"),
+            TextColumn("({task.completed}/{task.total})")
+        )
+        self.progress_task = self.progress.add_task("Progreso Total", total=None)
+        
+        self.metrics_panel = Panel("", title="Métricas de Rendimiento")
+        self.errors_panel = Panel("", title="Errores Recientes")
+        self.view = Panel(self.stats_table, title="Estado del Scraping")
+    
+    def build_workers_table(self, workers):
+        """Crea la tabla de workers activos a partir de su lista"""
+        table = Table(title=f"Workers Activos ({len(workers)})")
+        table.add_column("Worker ID")
+        table.add_column("Tareas")
+        table.add_column("Última Actualización")
+        
+        # Una sola referencia temporal para todas las filas de la tabla
+        now = datetime.now()
+        for worker in workers:
+            # Formatear tiempo transcurrido desde la última actualización
+            if isinstance(worker['last_update'], datetime):
+                seconds = (now - worker['last_update']).total_seconds()
+                if seconds < 60:
+                    time_ago = f"hace {seconds:.0f}s"
+                else:
+                    time_ago = f"hace {seconds/60:.1f}m"
+            else:
+                time_ago = "desconocido"
+                
+            table.add_row(
+                worker['worker_id'],
+                str(worker['tasks']),
+                time_ago
+            )
+        return table
+    
+    def render(self, snapshot):
+        """Vuelca una instantánea en la vista del monitor"""
+        queue_stats = snapshot['queue_stats']
+        progress_data = snapshot['progress']
+        workers = snapshot['workers']
+        metrics = snapshot['metrics']
+        errors = snapshot['errors']
+        
+        # Actualizar tabla de estadísticas: formatear todas las filas de una pasada
+        scale = 100 / (sum(queue_stats.values()) or 1)
+        rows = [
+            (queue_name, str(count), f"{count*scale:.1f}%")
+            for queue_name, count in queue_stats.items()
+        ]
+        
+        for queue_name, count, percent in rows:
+            if queue_name not in self.stats_cells:
+                cells = (Text(), Text())
+                self.stats_cells[queue_name] = cells
+                self.stats_table.add_row(queue_name.capitalize(), *cells)
+            count_cell, percent_cell = self.stats_cells[queue_name]
+            count_cell.plain = count
+            percent_cell.plain = percent
+        
+        # Rehacer la tabla de workers con las filas de esta instantánea
+        self.workers_table = self.build_workers_table(workers)
+        
+        # Actualizar barra de progreso
+        self.progress.update(
+            self.progress_task,
+            total=progress_data['total'],
+            completed=progress_data['processed']
+        )
+        
+        # Actualizar panel de métricas
+        metrics_text = f"""
 [bold]Tiempos de Procesamiento:[/bold]
 Promedio: {metrics['processing_times']['avg']:.2f}s
 Mínimo: {metrics['processing_times']['min']:.2f}s
@@ -239,42 +348,62 @@ Muestras: {metrics['processing_times']['count']}
 
 [bold]Tasas de Procesamiento:[/bold]
 """
-                    for worker_stat in metrics['worker_stats']:
-                        metrics_text += f"{worker_stat['worker_id']}: {worker_stat['rate']:.2f} tareas/min ({worker_stat['success']}/{worker_stat['total']} exitosas)\n"
-                    
-                    metrics_panel = Panel(metrics_text, title="Métricas de Rendimiento")
-                    
-                    # Crear panel de errores
-                    errors_text = "\n".join(errors) if errors else "No hay errores recientes"
-                    errors_panel = Panel(errors_text, title="Errores Recientes")
+        for worker_stat in metrics['worker_stats']:
+            metrics_text += f"{worker_stat['worker_id']}: {worker_stat['rate']:.2f} tareas/min ({worker_stat['success']}/{worker_stat['total']} exitosas)\n"
+        
+        self.metrics_panel.renderable = metrics_text
+        
+        # Actualizar panel de errores
+        self.errors_panel.renderable = "\n".join(errors) if errors else "No hay errores recientes"
+        
+        # ETA y tasa
+        self.view.subtitle = f"ETA: {progress_data['eta']} | Tasa: {progress_data['rate']:.2f} tareas/segundo"
+        
+        return self.view
+    
+    def run(self, refresh_rate=5, output_file=None):
+        """Ejecuta el monitor con actualización en tiempo real"""
+        # El archivo de salida se abre una sola vez; cada refresco es un append al buffer
+        output_fp = open(output_file, 'ab') if output_file else None
+        try:
+            # Las consultas se hacen en un hilo aparte; el hilo principal solo pinta
+            data_q = queue.Queue(maxsize=1)
+            collector = threading.Thread(
+                target=self.collector_loop,
+                args=(data_q, refresh_rate),
+                daemon=True
+            )
+            collector.start()
+            
+            # La vista se modifica en cada instantánea, así que solo se pinta al actualizarla
+            with Live(self.view, auto_refresh=False) as live:
+                while True:
+                    try:
+                        snapshot = data_q.get(timeout=refresh_rate)
+                    except queue.Empty:
+                        continue
                     
-                    # ETA y tasa
-                    eta_text = f"ETA: {progress_data['eta']} | Tasa: {progress_data['rate']:.2f} tareas/segundo"
+                    # Un fallo del hilo de recogida se muestra sin perder los últimos datos
+                    if 'error' in snapshot:
+                        self.view.subtitle = f"[red]⚠️ {snapshot['error']}[/red]"
+                        live.refresh()
+                        continue
                     
                     # Actualizar la visualización
-                    live.update(
-                        Panel(
-                            stats_table,
-                            title="Estado del Scraping",
-                            subtitle=eta_text
-                        )
-                    )
+                    live.update(self.render(snapshot), refresh=True)
                     
                     # Guardar datos en archivo si se solicita
-                    if output_file:
-                        with open(output_file, 'a') as f:
-                            timestamp = datetime.now().isoformat()
-                            data = {
-                                'timestamp': timestamp,
-                                'queue_stats': queue_stats,
-                                'progress': progress_data,
-                                'metrics': metrics,
-                                'workers': [w['worker_id'] for w in workers]
-                            }
-                            f.write(json.dumps(data) + '\n')
-                    
-                    # Esperar para la próxima actualización
-                    time.sleep(refresh_rate)
+                    if output_fp:
+                        timestamp = datetime.now().isoformat()
+                        data = {
+                            'timestamp': timestamp,
+                            'queue_stats': snapshot['queue_stats'],
+                            'progress': snapshot['progress'],
+                            'metrics': snapshot['metrics'],
+                            'workers': [w['worker_id'] for w in snapshot['workers']]
+                        }
+                        output_fp.write(orjson.dumps(data, option=orjson.OPT_APPEND_NEWLINE))
+                        output_fp.flush()
         
         except KeyboardInterrupt:
             print("\nMonitor detenido por el usuario")
@@ -283,6 +412,10 @@ Muestras: {metrics['processing_times']['count']}
             logger.error(f"Error en el monitor: {str(e)}")
             import traceback
             traceback.print_exc()
+        
+        finally:
+            if output_fp:
+                output_fp.close()
 
 def main():
     parser = argparse.ArgumentParser(description="Monitor de Scraping Distribuido")
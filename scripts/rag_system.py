@@ -1,22 +1,108 @@
 # rag_system.py
 
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
 import re
 import json
 import os
 import unicodedata
 import time  # Para limitar la frecuencia de requests a Google
+import threading
+import atexit
+import weakref
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
 from typing import Optional, Dict, Any
+import faiss
+import numpy as np
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.vectorstores import FAISS
-from langchain.embeddings import HuggingFaceEmbeddings
+from langchain.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain.embeddings import HuggingFaceEmbeddings, CacheBackedEmbeddings
+from langchain.storage import LocalFileStore
 from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
 from config import GROQ_API_KEY
 
-@dataclass
+# Patrones de extracción compilados una sola vez para todas las páginas.
+# Los de datos financieros van junto a la palabra clave literal que exigen: si no
+# aparece en el texto (búsqueda con `in`, en C) no hace falta recorrerlo con el regex
+LEGAL_FORM_RE = re.compile(r'\b(s\.a\.|s\.l\.|s\s*\.?\s*a\s*\.?|s\s*\.?\s*l\s*\.?)$')
+URL_RE = re.compile(r'https?://[^\s&]+')
+PERSONAL_ID_RE = re.compile(r'\b\d{8}[A-Z]\b')
+PHONE_RE = re.compile(r'\b\d{9}\b')
+EMAIL_RE = re.compile(r'\S+@\S+\.\S+')
+NIF_RES = (
+    ('nif', re.compile(r'NIF:?\s*([A-Z0-9]{9})', re.IGNORECASE)),
+)
+SECTOR_RES = (
+    ('sector', re.compile(r'Sector:?\s*([^\n\.]+)', re.IGNORECASE)),
+    ('cnae', re.compile(r'CNAE:?\s*([^\n\.]+)', re.IGNORECASE))
+)
+REVENUE_RES = (
+    ('facturación', re.compile(r'facturación:?\s*([\d\.,]+)\s*(?:€|EUR|euros|mil euros|millones)', re.IGNORECASE)),
+    ('ingresos', re.compile(r'ingresos:?\s*([\d\.,]+)\s*(?:€|EUR|euros|mil euros|millones)', re.IGNORECASE))
+)
+PROFIT_RES = (
+    ('resultado', re.compile(r'resultado:?\s*([\d\.,\-]+)\s*(?:€|EUR|euros|mil euros|millones)', re.IGNORECASE)),
+    ('beneficio', re.compile(r'beneficio:?\s*([\d\.,\-]+)\s*(?:€|EUR|euros|mil euros|millones)', re.IGNORECASE))
+)
+EMPLOYEE_RES = (
+    ('empleados', re.compile(r'empleados:?\s*(\d+)', re.IGNORECASE)),
+    ('trabajadores', re.compile(r'trabajadores:?\s*(\d+)', re.IGNORECASE)),
+    ('plantilla', re.compile(r'plantilla:?\s*(\d+)', re.IGNORECASE))
+)
+YEAR_RE = re.compile(r'(?:en|de|del)?\s*(?:año|ejercicio)?\s*(20\d{2})')
+FILENAME_UNSAFE_RE = re.compile(r'[^\w\-_\. ]')
+
+# Segundos mínimos entre dos búsquedas en Google
+SEARCH_INTERVAL = 1
+
+# Búsqueda directa en los dominios confiables que tienen un buscador por URL;
+# el resto se sigue consultando con site: en Google
+DOMAIN_SEARCH_URLS = {
+    "einforma.com": lambda name: (
+        f"https://www.einforma.com/servlet/app/portal/ENTP/prod/LISTA_EMPRESAS/razonsocial/{quote(name)}"
+    ),
+}
+
+# Chunks que se acumulan antes de calcular sus embeddings e indexarlos en FAISS
+VECTOR_FLUSH_SIZE = 512
+# Índice HNSW (búsqueda aproximada por grafo) en lugar del IndexFlatL2 exhaustivo
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+# Vectores almacenados en int8 (1 byte por dimensión) y normalizados, de modo
+# que el producto interno equivale a la similitud coseno
+SQ_TRAIN_SIZE = 10000
+# Por debajo de este número de vectores se usa un índice exacto (IndexFlatIP): entrenar el
+# cuantizador con pocos vectores fijaría rangos min/max que recortarían los siguientes
+SQ_MIN_TRAIN_SIZE = 4096
+VECTOR_STORE_KWARGS = {
+    "normalize_L2": True,
+    "distance_strategy": DistanceStrategy.MAX_INNER_PRODUCT,
+}
+
+def _first_match(patterns, content: str, lowered: str):
+    """Primer patrón (en orden de prioridad) que encuentra algo, sin escanear los que no pueden coincidir"""
+    for keyword, pattern in patterns:
+        if keyword in lowered:
+            match = pattern.search(content)
+            if match:
+                return match
+    return None
+
+def _close_at_exit(system_ref):
+    """Cierre en atexit de un FinancialRAGSystem que siga vivo"""
+    system = system_ref()
+    if system is not None:
+        system.close()
+
+# slots: sin __dict__ por instancia (requiere Python 3.10, igual que numpy 2.2)
+@dataclass(slots=True)
 class CompanyFinancialInfo:
     name: str
     nif: Optional[str] = None
@@ -62,6 +148,10 @@ class FinancialRAGSystem:
         "dni", "pasaporte", "cuenta bancaria", "tarjeta", "clave", "contraseña",
         "personal", "privado", "confidencial", "secreto"
     ]
+    BLACKLIST_RES = [
+        (term, re.compile(r'.{0,50}' + term + r'.{0,50}', re.IGNORECASE))
+        for term in BLACKLIST_TERMS
+    ]
     
     def __init__(self, groq_model: str, cache_dir: str = "./cache", embedding_model: str = "all-MiniLM-L6-v2"):
         """
@@ -74,14 +164,40 @@ class FinancialRAGSystem:
         """
         self.cache_dir = cache_dir
         os.makedirs(cache_dir, exist_ok=True)
-        self.setup_vector_db()
+        
+        # Chunks pendientes de indexar en FAISS (ver flush_vector_db)
+        self._pending_texts = []
+        self._pending_metadatas = []
+        # Al salir del intérprete se indexa lo que quede pendiente (sin retener la instancia)
+        atexit.register(_close_at_exit, weakref.ref(self))
+        
+        # Turno de búsquedas en Google compartido por los hilos de _search_online
+        self._search_lock = threading.Lock()
+        self._next_search_at = 0.0
+        
+        # Sesión HTTP compartida por los hilos: reutiliza conexiones keep-alive
+        # (y el handshake TLS) entre búsquedas y descargas del mismo dominio
+        self._http = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=len(self.TRUSTED_DOMAINS) + 1,
+            pool_maxsize=len(self.TRUSTED_DOMAINS) * 2
+        )
+        self._http.mount('http://', adapter)
+        self._http.mount('https://', adapter)
         
         # Se utiliza HuggingFace para transformar el texto en embeddings,
         # y FAISS para indexarlos y permitir búsquedas semánticas.
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name=embedding_model,
-            model_kwargs={'device': 'cpu'}
+        # Los embeddings de cada chunk se guardan en disco (clave: hash del texto), así
+        # que los chunks repetidos entre búsquedas o por el solapamiento no se recalculan
+        self.embeddings = CacheBackedEmbeddings.from_bytes_store(
+            HuggingFaceEmbeddings(
+                model_name=embedding_model,
+                model_kwargs={'device': 'cpu'}
+            ),
+            LocalFileStore(os.path.join(cache_dir, "embeddings")),
+            namespace=embedding_model
         )
+        self.setup_vector_db()
         
         # Inicializamos el LLM de Groq con el modelo seleccionado
         from langchain_groq import ChatGroq
@@ -109,7 +225,20 @@ class FinancialRAGSystem:
         """Configura o carga la base de datos vectorial."""
         self.vectordb_path = os.path.join(self.cache_dir, "faiss_index")
         if os.path.exists(os.path.join(self.vectordb_path, "index.faiss")):
-            self.vectordb = FAISS.load_local(self.vectordb_path, self.embeddings)
+            vectordb = FAISS.load_local(self.vectordb_path, self.embeddings)
+            if isinstance(vectordb.index, faiss.IndexFlatL2):
+                # Índice guardado antes del cambio a producto interno: sus vectores no están
+                # normalizados, así que se sigue consultando con distancia L2 y sin normalizar
+                self.vectordb = vectordb
+            else:
+                # langchain no guarda estos ajustes: se reconstruye el almacén con ellos
+                self.vectordb = FAISS(
+                    embedding_function=self.embeddings,
+                    index=vectordb.index,
+                    docstore=vectordb.docstore,
+                    index_to_docstore_id=vectordb.index_to_docstore_id,
+                    **VECTOR_STORE_KWARGS
+                )
         else:
             self.vectordb = None
     
@@ -126,7 +255,7 @@ class FinancialRAGSystem:
             
             # Normalize company name for better searching
             normalized_name = company_name.strip().lower()
-            normalized_name = re.sub(r'\b(s\.a\.|s\.l\.|s\s*\.?\s*a\s*\.?|s\s*\.?\s*l\s*\.?)$', '', normalized_name).strip()
+            normalized_name = LEGAL_FORM_RE.sub('', normalized_name).strip()
             
             company_info = self._search_online(normalized_name)
             with open(cache_file, 'w', encoding='utf-8') as f:
@@ -137,51 +266,106 @@ class FinancialRAGSystem:
             # Return minimal info to prevent errors
             return {"name": company_name, "error": str(e)}
     
+    @staticmethod
+    def _merge_financial_info(company_info: CompanyFinancialInfo, extracted_info: CompanyFinancialInfo):
+        """Copia en company_info los campos que se hayan encontrado en extracted_info."""
+        if extracted_info.nif:
+            company_info.nif = extracted_info.nif
+        if extracted_info.sector:
+            company_info.sector = extracted_info.sector
+        if extracted_info.revenue:
+            company_info.revenue = extracted_info.revenue
+        if extracted_info.profit:
+            company_info.profit = extracted_info.profit
+        if extracted_info.employees:
+            company_info.employees = extracted_info.employees
+        if extracted_info.year:
+            company_info.year = extracted_info.year
+    
+    @staticmethod
+    def _has_financial_data(company_info: CompanyFinancialInfo) -> bool:
+        return bool(company_info.revenue or company_info.profit or company_info.employees)
+    
+    def _wait_search_slot(self):
+        """Reserva el siguiente hueco de búsqueda en Google (como mucho una por segundo)."""
+        with self._search_lock:
+            now = time.monotonic()
+            wait = self._next_search_at - now
+            self._next_search_at = max(now, self._next_search_at) + SEARCH_INTERVAL
+        if wait > 0:
+            time.sleep(wait)
+    
+    def _probe_domain(self, domain: str, company_name: str, found: threading.Event) -> CompanyFinancialInfo:
+        """Busca la empresa en un dominio confiable y extrae la información de sus páginas."""
+        company_info = CompanyFinancialInfo(name=company_name)
+        try:
+            # Buscador propio del dominio: una sola petición, sin pasar por Google
+            if domain in DOMAIN_SEARCH_URLS:
+                page_content = self._fetch_page_safely(DOMAIN_SEARCH_URLS[domain](company_name))
+                if page_content:
+                    safe_content = self._sanitize_content(page_content)
+                    self._merge_financial_info(
+                        company_info, self._extract_financial_data(safe_content, company_name)
+                    )
+                    if self._has_financial_data(company_info):
+                        return company_info
+            
+            # Si no hay buscador propio o no dio resultado, buscar en Google
+            self._wait_search_slot()  # Respeta el límite de requests de Google
+            if found.is_set():
+                return company_info
+            search_url = f"https://www.google.com/search?q=site:{domain}+{company_name}+información+financiera"
+            headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'}
+            response = self._http.get(search_url, headers=headers, timeout=10)
+            if response.status_code == 200:
+                soup = BeautifulSoup(response.text, 'lxml')
+                for result in soup.select('a'):
+                    # Otro dominio ya dio con la información: no seguir descargando
+                    if found.is_set():
+                        break
+                    href = result.get('href', '')
+                    if domain in href and 'google' not in href:
+                        url_matches = URL_RE.findall(href)
+                        if not url_matches:
+                            continue
+                        url = url_matches[0]
+                        if any(td in url for td in self.TRUSTED_DOMAINS):
+                            page_content = self._fetch_page_safely(url)
+                            if page_content:
+                                safe_content = self._sanitize_content(page_content)
+                                extracted_info = self._extract_financial_data(safe_content, company_name)
+                                # Actualizamos la información financiera si se encontró
+                                self._merge_financial_info(company_info, extracted_info)
+                                # Si se obtuvo información relevante, se detiene la búsqueda
+                                if self._has_financial_data(company_info):
+                                    break
+        except Exception as e:
+            print(f"Error buscando en {domain}: {str(e)}")
+        return company_info
+    
     def _search_online(self, company_name: str) -> CompanyFinancialInfo:
         """
         Realiza una búsqueda en línea en dominios confiables para extraer información
-        financiera pública. Se respeta un límite de requests (pausando 1 segundo entre cada búsqueda).
+        financiera pública. Los dominios se consultan en paralelo, aunque las búsquedas
+        en Google siguen espaciadas 1 segundo; en cuanto uno aporta facturación, beneficio
+        o empleados se dejan de lado los demás.
         """
         company_info = CompanyFinancialInfo(name=company_name)
-        for domain in self.TRUSTED_DOMAINS:
-            try:
-                time.sleep(1)  # Respeta el límite de requests de Google
-                search_url = f"https://www.google.com/search?q=site:{domain}+{company_name}+información+financiera"
-                headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'}
-                response = requests.get(search_url, headers=headers, timeout=10)
-                if response.status_code == 200:
-                    soup = BeautifulSoup(response.text, 'html.parser')
-                    for result in soup.select('a'):
-                        href = result.get('href', '')
-                        if domain in href and 'google' not in href:
-                            url_matches = re.findall(r'https?://[^\s&]+', href)
-                            if not url_matches:
-                                continue
-                            url = url_matches[0]
-                            if any(td in url for td in self.TRUSTED_DOMAINS):
-                                page_content = self._fetch_page_safely(url)
-                                if page_content:
-                                    safe_content = self._sanitize_content(page_content)
-                                    extracted_info = self._extract_financial_data(safe_content, company_name)
-                                    # Actualizamos la información financiera si se encontró
-                                    if extracted_info.nif:
-                                        company_info.nif = extracted_info.nif
-                                    if extracted_info.sector:
-                                        company_info.sector = extracted_info.sector
-                                    if extracted_info.revenue:
-                                        company_info.revenue = extracted_info.revenue
-                                    if extracted_info.profit:
-                                        company_info.profit = extracted_info.profit
-                                    if extracted_info.employees:
-                                        company_info.employees = extracted_info.employees
-                                    if extracted_info.year:
-                                        company_info.year = extracted_info.year
-                                    # Si se obtuvo información relevante, se detiene la búsqueda
-                                    if company_info.revenue or company_info.profit or company_info.employees:
-                                        break
-            except Exception as e:
-                print(f"Error buscando en {domain}: {str(e)}")
-                continue
+        found = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=len(self.TRUSTED_DOMAINS))
+        try:
+            futures = [
+                executor.submit(self._probe_domain, domain, company_name, found)
+                for domain in self.TRUSTED_DOMAINS
+            ]
+            for future in as_completed(futures):
+                self._merge_financial_info(company_info, future.result())
+                if self._has_financial_data(company_info):
+                    found.set()
+                    break
+        finally:
+            # No esperar a los dominios pendientes: al ver `found` terminan por su cuenta
+            executor.shutdown(wait=False, cancel_futures=True)
         return company_info
     
     def _fetch_page_safely(self, url: str) -> Optional[str]:
@@ -190,7 +374,7 @@ class FinancialRAGSystem:
             if not any(domain in url for domain in self.TRUSTED_DOMAINS):
                 return None
             headers = {'User-Agent': 'Mozilla/5.0'}
-            response = requests.get(url, headers=headers, timeout=10)
+            response = self._http.get(url, headers=headers, timeout=10)
             if response.status_code == 200:
                 return response.text
         except Exception as e:
@@ -199,14 +383,16 @@ class FinancialRAGSystem:
     
     def _sanitize_content(self, content: str) -> str:
         """Elimina información sensible del contenido descargado."""
-        soup = BeautifulSoup(content, 'html.parser')
+        soup = BeautifulSoup(content, 'lxml')
         text = soup.get_text(separator=' ', strip=True)
-        for term in self.BLACKLIST_TERMS:
-            pattern = re.compile(r'.{0,50}' + term + r'.{0,50}', re.IGNORECASE)
-            text = pattern.sub('[INFORMACIÓN PROTEGIDA]', text)
-        text = re.sub(r'\b\d{8}[A-Z]\b', '[ID PROTEGIDO]', text)
-        text = re.sub(r'\b\d{9}\b', '[TELÉFONO]', text)
-        text = re.sub(r'\S+@\S+\.\S+', '[EMAIL]', text)
+        # El patrón .{0,50}término.{0,50} es caro: solo se aplica si el término aparece
+        lowered = text.lower()
+        for term, pattern in self.BLACKLIST_RES:
+            if term in lowered:
+                text = pattern.sub('[INFORMACIÓN PROTEGIDA]', text)
+        text = PERSONAL_ID_RE.sub('[ID PROTEGIDO]', text)
+        text = PHONE_RE.sub('[TELÉFONO]', text)
+        text = EMAIL_RE.sub('[EMAIL]', text)
         return text
     
     def _extract_financial_data(self, content: str, company_name: str) -> CompanyFinancialInfo:
@@ -215,66 +401,39 @@ class FinancialRAGSystem:
         número de empleados, sector y año de ejercicio) a partir del contenido.
         """
         info = CompanyFinancialInfo(name=company_name)
+        lowered = content.lower()
         
         # Extraer NIF
-        nif_pattern = re.compile(r'NIF:?\s*([A-Z0-9]{9})', re.IGNORECASE)
-        nif_match = nif_pattern.search(content)
+        nif_match = _first_match(NIF_RES, content, lowered)
         if nif_match:
             info.nif = nif_match.group(1)
         
         # Extraer sector (o CNAE)
-        sector_patterns = [
-            re.compile(r'Sector:?\s*([^\n\.]+)', re.IGNORECASE),
-            re.compile(r'CNAE:?\s*([^\n\.]+)', re.IGNORECASE)
-        ]
-        for pattern in sector_patterns:
-            match = pattern.search(content)
-            if match:
-                info.sector = match.group(1).strip()
-                break
+        match = _first_match(SECTOR_RES, content, lowered)
+        if match:
+            info.sector = match.group(1).strip()
         
         # Extraer facturación (ingresos)
-        revenue_patterns = [
-            re.compile(r'facturación:?\s*([\d\.,]+)\s*(?:€|EUR|euros|mil euros|millones)', re.IGNORECASE),
-            re.compile(r'ingresos:?\s*([\d\.,]+)\s*(?:€|EUR|euros|mil euros|millones)', re.IGNORECASE)
-        ]
-        for pattern in revenue_patterns:
-            match = pattern.search(content)
-            if match:
-                info.revenue = match.group(1).strip()
-                year_pattern = re.compile(r'(?:en|de|del)?\s*(?:año|ejercicio)?\s*(20\d{2})')
-                year_match = year_pattern.search(content[match.start()-50:match.start()+100])
-                if year_match:
-                    info.year = year_match.group(1)
-                break
+        match = _first_match(REVENUE_RES, content, lowered)
+        if match:
+            info.revenue = match.group(1).strip()
+            year_match = YEAR_RE.search(content[match.start()-50:match.start()+100])
+            if year_match:
+                info.year = year_match.group(1)
         
         # Extraer beneficio o resultado
-        profit_patterns = [
-            re.compile(r'resultado:?\s*([\d\.,\-]+)\s*(?:€|EUR|euros|mil euros|millones)', re.IGNORECASE),
-            re.compile(r'beneficio:?\s*([\d\.,\-]+)\s*(?:€|EUR|euros|mil euros|millones)', re.IGNORECASE)
-        ]
-        for pattern in profit_patterns:
-            match = pattern.search(content)
-            if match:
-                info.profit = match.group(1).strip()
-                if not info.year:
-                    year_pattern = re.compile(r'(?:en|de|del)?\s*(?:año|ejercicio)?\s*(20\d{2})')
-                    year_match = year_pattern.search(content[match.start()-50:match.start()+100])
-                    if year_match:
-                        info.year = year_match.group(1)
-                break
+        match = _first_match(PROFIT_RES, content, lowered)
+        if match:
+            info.profit = match.group(1).strip()
+            if not info.year:
+                year_match = YEAR_RE.search(content[match.start()-50:match.start()+100])
+                if year_match:
+                    info.year = year_match.group(1)
         
         # Extraer número de empleados
-        employee_patterns = [
-            re.compile(r'empleados:?\s*(\d+)', re.IGNORECASE),
-            re.compile(r'trabajadores:?\s*(\d+)', re.IGNORECASE),
-            re.compile(r'plantilla:?\s*(\d+)', re.IGNORECASE)
-        ]
-        for pattern in employee_patterns:
-            match = pattern.search(content)
-            if match:
-                info.employees = match.group(1).strip()
-                break
+        match = _first_match(EMPLOYEE_RES, content, lowered)
+        if match:
+            info.employees = match.group(1).strip()
         
         return info
     
@@ -282,29 +441,76 @@ class FinancialRAGSystem:
         """
         Agrega el contenido obtenido a la base de datos vectorial para consultas RAG.
         Se utiliza un divisor de texto para fragmentar el contenido en chunks.
+        Los chunks se acumulan y se indexan por lotes de VECTOR_FLUSH_SIZE (ver flush_vector_db).
         """
         text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=1000,
             chunk_overlap=200
         )
         chunks = text_splitter.split_text(content)
-        texts_with_metadata = [
+        self._pending_texts.extend(chunks)
+        self._pending_metadatas.extend(
             {"content": chunk, "company": company_name, "source": url}
             for chunk in chunks
-        ]
+        )
+        if len(self._pending_texts) >= VECTOR_FLUSH_SIZE:
+            self.flush_vector_db()
+    
+    def flush_vector_db(self):
+        """
+        Calcula en una sola llamada los embeddings de todos los chunks pendientes,
+        los añade al índice FAISS y lo guarda en disco una vez.
+        """
+        if not self._pending_texts:
+            return
+        texts, metadatas = self._pending_texts, self._pending_metadatas
+        self._pending_texts, self._pending_metadatas = [], []
+        
+        vectors = self.embeddings.embed_documents(texts)
         if self.vectordb is None:
-            self.vectordb = FAISS.from_texts(
-                [t["content"] for t in texts_with_metadata],
-                self.embeddings,
-                metadatas=texts_with_metadata
-            )
-            self.vectordb.save_local(self.vectordb_path)
-        else:
-            self.vectordb.add_texts(
-                [t["content"] for t in texts_with_metadata],
-                metadatas=texts_with_metadata
-            )
-            self.vectordb.save_local(self.vectordb_path)
+            self.vectordb = self._new_vector_db(len(vectors[0]))
+        self.vectordb.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas)
+        self._quantize_vector_db()
+        self.vectordb.save_local(self.vectordb_path)
+    
+    def close(self):
+        """Indexa y guarda en disco los chunks pendientes; llamar al terminar de usar el sistema."""
+        self.flush_vector_db()
+    
+    def _new_vector_db(self, dimension: int) -> FAISS:
+        """
+        Crea un almacén FAISS vacío sobre un índice exacto de producto interno.
+        Pasa a HNSW con cuantización de 8 bits al reunir SQ_MIN_TRAIN_SIZE vectores.
+        """
+        return FAISS(
+            embedding_function=self.embeddings,
+            index=faiss.IndexFlatIP(dimension),
+            docstore=InMemoryDocstore({}),
+            index_to_docstore_id={},
+            **VECTOR_STORE_KWARGS
+        )
+    
+    def _quantize_vector_db(self):
+        """
+        Sustituye el índice exacto por un IndexHNSWSQ de 8 bits en cuanto hay vectores
+        suficientes, entrenando el cuantizador con una muestra aleatoria de todos ellos.
+        Las posiciones se conservan, así que index_to_docstore_id sigue siendo válido.
+        """
+        index = self.vectordb.index
+        if not isinstance(index, faiss.IndexFlatIP) or index.ntotal < SQ_MIN_TRAIN_SIZE:
+            return
+        vectors = index.reconstruct_n(0, index.ntotal)  # ya normalizados al añadirlos
+        sample = vectors[np.random.default_rng().permutation(len(vectors))[:SQ_TRAIN_SIZE]]
+        quantized = faiss.IndexHNSWSQ(
+            index.d,
+            faiss.ScalarQuantizer.QT_8bit,
+            HNSW_M,
+            faiss.METRIC_INNER_PRODUCT
+        )
+        quantized.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        quantized.train(sample)
+        quantized.add(vectors)
+        self.vectordb.index = quantized
     
     def answer_financial_question(self, company_name: str, question: str) -> str:
         """
@@ -312,8 +518,13 @@ class FinancialRAGSystem:
         enfoque Retrieval-Augmented Generation (RAG). Se filtra la información
         relevante de la base vectorial y se pasa al LLM.
         """
+        # Indexar lo pendiente para que la consulta vea todo lo descargado
+        self.flush_vector_db()
         if self.vectordb is None:
             return "No tengo información financiera disponible. Por favor, realiza primero una búsqueda de la empresa."
+        # Los índices exactos (pequeños o guardados antes del cambio a HNSW) no tienen efSearch
+        if hasattr(self.vectordb.index, "hnsw"):
+            self.vectordb.index.hnsw.efSearch = HNSW_EF_SEARCH
         
         retriever = self.vectordb.as_retriever(
             search_kwargs={"k": 3, "filter": {"company": company_name}}
@@ -339,4 +550,4 @@ class FinancialRAGSystem:
         """Sanitiza el nombre para que sea seguro en el sistema de archivos."""
         filename = ''.join(c for c in unicodedata.normalize('NFD', filename)
                            if unicodedata.category(c) != 'Mn')
-        return re.sub(r'[^\w\-_\. ]', '_', filename)
+        return FILENAME_UNSAFE_RE.sub('_', filename)
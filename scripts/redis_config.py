@@ -1,4 +1,5 @@
 import os
+import socket
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -8,6 +9,15 @@ REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
 REDIS_PASSWORD = os.getenv("REDIS_PASSWORD")
 REDIS_USERNAME = os.getenv("REDIS_USERNAME", "default")
 
+# TCP keepalive en los clientes: las conexiones muertas se detectan y cierran solas
+# en lugar de acumularse en el servidor (TCP_KEEPIDLE no existe en todas las plataformas)
+REDIS_SOCKET_KEEPALIVE_OPTIONS = {
+    option: value
+    for name, value in (("TCP_KEEPIDLE", 30), ("TCP_KEEPINTVL", 10), ("TCP_KEEPCNT", 3))
+    if (option := getattr(socket, name, None)) is not None
+}
+REDIS_HEALTH_CHECK_INTERVAL = 30  # segundos
+
 # Colas de trabajo
 REDIS_QUEUE_PENDING = "scraper:pending"
 REDIS_QUEUE_PROCESSING = "scraper:processing"
@@ -28,4 +38,21 @@ REDIS_RATE_LIMIT_MAX = 60  # solicitudes por minuto
 TASK_PROCESSING_TTL = 3600  # 1 hora
 
 # Métricas
-REDIS_METRICS_PREFIX = "scraper:metrics:"
\ No newline at end of file
+REDIS_METRICS_PREFIX = "scraper:metrics:"
+
+# Caché compartida de estados HTTP por dominio (hash dominio -> {status, checked_at})
+REDIS_URL_STATUS_CACHE = "scraper:url_status"
+URL_STATUS_CACHE_TTL = 86400  # 24 horas
+
+# Segundos que las cachés esperan a Redis antes de darse por vencidas y seguir sin caché
+REDIS_CACHE_SOCKET_TIMEOUT = 1.5
+
+# Caché del HTML descargado por URL (clave prefijo + sha1 de la URL, valor gzip).
+# Es opcional y va en su propia instancia: las páginas ocupan demasiado para compartir
+# el Redis de las colas (plan gratuito de Redis Cloud)
+REDIS_PAGE_CACHE_URL = os.getenv("REDIS_PAGE_CACHE_URL")
+REDIS_PAGE_CACHE_PREFIX = "scraper:page:"
+PAGE_CACHE_TTL = 86400  # 24 horas
+
+# Canal pub/sub donde TaskManager avisa de cada cambio en las colas
+REDIS_EVENTS_CHANNEL = "scraper:events"
@@ -1,25 +1,50 @@
+import argparse
 import concurrent
+import copy
 import traceback
-from urllib.parse import urlparse
+import gzip
+import hashlib
+import os
+import redis
+from urllib.parse import urlparse, urlsplit, urlunsplit
+from html import unescape
 import requests
 import re
 from urllib3.exceptions import InsecureRequestWarning
 import urllib3
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
+from urllib3.util.request import ACCEPT_ENCODING
 import unicodedata
+import ahocorasick
 from bs4 import BeautifulSoup
+import lxml.html
+from lxml import etree
 from datetime import datetime
 import dns.resolver
-from functools import wraps
 import time
+import random
+import threading
 import socket
+from email.utils import parsedate_to_datetime
 import json
 import psycopg2
+from psycopg2.extras import execute_values
 import logging
-from typing import List, Dict, Any, Tuple, Set
+from typing import List, Dict, Any, Tuple, Set, Optional
+from dataclasses import dataclass, field, replace
 from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
+from collections import OrderedDict
 from config import DB_CONFIG, TIMEOUT_CONFIG
+from redis_config import (
+    REDIS_PAGE_CACHE_URL,
+    REDIS_PAGE_CACHE_PREFIX,
+    PAGE_CACHE_TTL,
+    REDIS_CACHE_SOCKET_TIMEOUT,
+)
+from task_manager import get_connection_pool
 import urllib3
 import warnings
 
@@ -42,25 +67,377 @@ logger = logging.getLogger(__name__)
 # Disable SSL warnings
 urllib3.disable_warnings(InsecureRequestWarning)
 
-class RateLimiter:
-    def __init__(self, calls_per_minute=30):
-        self.calls_per_minute = calls_per_minute
-        self.calls = []
+# Empresas de un lote que se rastrean a la vez en process_batch
+BATCH_MAX_WORKERS = 8
+# Filas por UPDATE al guardar un lote: si una escritura falla solo se repite ese tramo
+UPDATE_CHUNK_SIZE = 100
+
+# Sesiones HTTP compartidas por todo el módulo: reutilizan conexiones (y el handshake TLS)
+# entre el HEAD de verificación y el GET del contenido del mismo host.
+# Cada empresa del lote puede verificar hasta 4 URLs en paralelo (verify_urls_parallel)
+HTTP_POOL_MAXSIZE = BATCH_MAX_WORKERS * 4
+DEFAULT_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/91.0.4472.124 Safari/537.36'
+
+def _build_session(max_retries) -> requests.Session:
+    session = requests.Session()
+    session.headers['User-Agent'] = DEFAULT_USER_AGENT
+    # Todas las codificaciones que urllib3 sabe descomprimir ("br" si está instalado brotli),
+    # no solo el "gzip, deflate" por defecto de requests
+    session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+    adapter = HTTPAdapter(
+        pool_connections=64,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        max_retries=max_retries
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+# Expresiones regulares compiladas una sola vez para todas las páginas analizadas
+COMPANY_NAME_PUNCT_RE = re.compile(r'[^\w\s-]')
+LEGAL_SUFFIX_RES = (
+    re.compile(r'(-sa|-s\.a\.|sa|sociedad-anonima|sociedad-anonyma)$', re.IGNORECASE),
+    re.compile(r'(-sl|-s\.l\.|sl|sociedad-limitada)$', re.IGNORECASE)
+)
+TEL_HREF_RE = re.compile(r'^tel:')
+DATA_ATTR_RE = re.compile(r'^data-')
+PHONE_RE = re.compile(r'(?:\+34|0034|34)?[\s-]?(?:[\s-]?\d){9}')
+NON_PHONE_CHARS_RE = re.compile(r'[^\d+]')
+# Lo que PHONE_RE puede capturar además de dígitos ('+', '-' y espacios, también Unicode):
+# str.translate lo elimina en C sin pasar por el motor de regex
+PHONE_STRIP_TABLE = str.maketrans('', '', ''.join(
+    c for c in map(chr, range(0x3001))
+    if (c.isascii() and not c.isdigit()) or c.isspace()
+))
+ASCII_DIGITS = '0123456789'
+SOCIAL_PATTERNS = {
+    'facebook': re.compile(r'facebook\.com/(?!sharer|share)([^/?&]+)'),
+    'twitter': re.compile(r'twitter\.com/(?!share|intent)([^/?&]+)'),
+    'instagram': re.compile(r'instagram\.com/([^/?&]+)'),
+    'linkedin': re.compile(r'linkedin\.com/(?:company|in)/([^/?&]+)'),
+    'youtube': re.compile(r'youtube\.com/(?:user|channel|c)/([^/?&]+)')
+}
+# Dominio registrado -> red social, para clasificar cada enlace con una búsqueda en diccionario
+SOCIAL_NETWORK_BY_DOMAIN = {f'{network}.com': network for network in SOCIAL_PATTERNS}
+# href de etiquetas <a> que apuntan a alguna red social, para recorrer el HTML en bruto de una pasada
+SOCIAL_HREF_RE = re.compile(
+    r'<a\b[^>]*?\shref\s*=\s*["\']([^"\']*(?:facebook|twitter|instagram|linkedin|youtube)\.com[^"\']*)["\']',
+    re.IGNORECASE
+)
+# Todas las clases/IDs típicos de ecommerce en una sola alternancia: un único recorrido del árbol
+ECOMMERCE_CLASS_NAMES = ['cart', 'checkout', 'basket', 'shop', 'store', 'product', 'price']
+ECOMMERCE_CLASS_RE = re.compile('|'.join(ECOMMERCE_CLASS_NAMES))
+# Indicadores de tienda en enlaces (texto o href): una alternancia por categoría,
+# de modo que cada enlace se comprueba con un regex por categoría y no término a término
+ECOMMERCE_LINK_INDICATORS = {
+    'carrito_compra': [
+        'carrito', 'cart', 'cesta', 'basket', 'shopping', 'comprar'
+    ],
+    'botones_compra': [
+        'añadir al carrito', 'add to cart', 'comprar ahora', 'buy now',
+        'realizar pedido', 'checkout', 'agregar al carrito', 'comprar', 'tienda online'
+    ],
+    'elementos_tienda': [
+        'tienda', 'shop', 'store', 'catálogo', 'catalog', 'productos', 'products'
+    ]
+}
+ECOMMERCE_LINK_RES = tuple(
+    re.compile('|'.join(map(re.escape, indicators)))
+    for indicators in ECOMMERCE_LINK_INDICATORS.values()
+)
+ECOMMERCE_FORM_ACTION_RE = re.compile(r'cart|checkout|payment|compra|pago', re.IGNORECASE)
+PRICE_RE = re.compile(r'(?:€|EUR)\s*\d+(?:[.,]\d{2})?|\d+(?:[.,]\d{2})?\s*(?:€|EUR)', re.IGNORECASE)
+# Charset declarado en la cabecera del HTML (se busca sobre los bytes, sin decodificar)
+META_CHARSET_RE = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?([\w.:-]+)', re.IGNORECASE)
+META_CHARSET_WINDOW = 4096
+# Tope de bytes que se leen de una página; lo que pase de ahí no se descarga
+MAX_PAGE_BYTES = 2 * 1024 * 1024
+PAGE_CHUNK_SIZE = 64 * 1024
+
+def build_term_automaton(terms) -> Optional[ahocorasick.Automaton]:
+    """Autómata Aho-Corasick con los términos no vacíos (None si no hay ninguno)"""
+    automaton = ahocorasick.Automaton()
+    for term in terms:
+        if term:
+            automaton.add_word(term, term)
+    if not len(automaton):
+        return None
+    automaton.make_automaton()
+    return automaton
+
+def find_terms(text: str, automaton: Optional[ahocorasick.Automaton]) -> Set[str]:
+    """Devuelve qué términos del autómata aparecen en el texto, recorriéndolo una sola vez"""
+    if automaton is None:
+        return set()
+    return {term for _, term in automaton.iter(text)}
+
+def page_text(html: Optional[str], soup: BeautifulSoup) -> str:
+    """
+    Texto visible de la página extraído en C por lxml (sin <script> ni <style>),
+    en lugar de concatenar en Python todos los nodos de texto del árbol de BeautifulSoup.
+    soup.get_text() tampoco incluye <script> ni <style> (beautifulsoup4 >= 4.10, en
+    requirements 4.11.1), así que el scoring y detect_ecommerce ven el mismo texto que antes
+    """
+    if html:
+        try:
+            tree = lxml.html.document_fromstring(html)
+            etree.strip_elements(tree, 'script', 'style', with_tail=False)
+            return tree.text_content()
+        except (etree.ParserError, ValueError):
+            pass
+    return soup.get_text()
+
+# Descarga de contenido (sin reintentos, como hasta ahora)
+HTTP_SESSION = _build_session(max_retries=0)
+# Comprobaciones HEAD de último recurso, con reintentos ante errores 5xx
+RETRY_SESSION = _build_session(max_retries=Retry(
+    total=2,
+    backoff_factor=0.5,
+    status_forcelist=[500, 502, 503, 504]
+))
+
+@lru_cache(maxsize=1)
+def _get_page_cache() -> Optional[redis.Redis]:
+    """Cliente Redis para la caché de páginas descargadas (None si REDIS_PAGE_CACHE_URL no está definida)"""
+    if not REDIS_PAGE_CACHE_URL:
+        return None
+    return redis.Redis(connection_pool=get_connection_pool(
+        'page_cache',
+        url=REDIS_PAGE_CACHE_URL,
+        decode_responses=False,
+        socket_timeout=REDIS_CACHE_SOCKET_TIMEOUT,
+    ))
+
+def _page_cache_key(url: str) -> bytes:
+    return REDIS_PAGE_CACHE_PREFIX.encode() + hashlib.sha1(url.encode()).digest()
+
+def get_cached_page(url: str) -> Optional[str]:
+    """Devuelve el HTML de la URL si se descargó en las últimas PAGE_CACHE_TTL segundos"""
+    cache = _get_page_cache()
+    if cache is None:
+        return None
+    try:
+        cached = cache.get(_page_cache_key(url))
+    except redis.RedisError:
+        return None
+    return gzip.decompress(cached).decode() if cached else None
+
+def save_cached_page(url: str, content: str):
+    """Guarda comprimido el HTML descargado para no repetir la petición en otras ejecuciones"""
+    cache = _get_page_cache()
+    if cache is None:
+        return
+    try:
+        cache.setex(_page_cache_key(url), PAGE_CACHE_TTL, gzip.compress(content.encode()))
+    except redis.RedisError:
+        pass
+
+class HostRateLimiter:
+    """
+    Limita las descargas por host: como mucho max_concurrent a la vez y, tras un 429/503,
+    ninguna hasta el momento que indique el servidor (Retry-After) o el backoff.
+    Las esperas de más de max_delay segundos no se hacen: se devuelve la respuesta 429/503
+    """
+    def __init__(self, max_concurrent=8, max_retries=3, backoff_base=0.5,
+                 max_delay=60.0, max_hosts=1024):
+        self.max_concurrent = max_concurrent
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.max_delay = max_delay
+        self.max_hosts = max_hosts
+        # host -> [semáforo, próximo instante permitido, descargas en curso], del menos al
+        # más reciente; se olvidan los hosts inactivos más antiguos al pasar de max_hosts
+        self.hosts = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def _acquire_host(self, host: str) -> list:
+        with self.lock:
+            state = self.hosts.get(host)
+            if state is None:
+                state = self.hosts[host] = [threading.BoundedSemaphore(self.max_concurrent), 0.0, 1]
+                self._evict_idle_hosts()
+            else:
+                self.hosts.move_to_end(host)
+                state[2] += 1
+            return state
+    
+    def _release_host(self, state: list):
+        with self.lock:
+            state[2] -= 1
+    
+    def _evict_idle_hosts(self):
+        """Olvida los hosts más antiguos sin descargas en curso ni espera pendiente (con self.lock)"""
+        excess = len(self.hosts) - self.max_hosts
+        if excess <= 0:
+            return
+        now = time.monotonic()
+        idle = [
+            host for host, (_, next_allowed, active) in self.hosts.items()
+            if not active and next_allowed <= now
+        ]
+        for host in idle[:excess]:
+            del self.hosts[host]
+    
+    def retry_delay(self, response: requests.Response, attempt: int) -> float:
+        """Segundos a esperar según Retry-After (segundos o fecha HTTP) o, si no viene, backoff exponencial con jitter"""
+        retry_after = response.headers.get('Retry-After')
+        if retry_after:
+            try:
+                return max(0.0, float(retry_after))
+            except ValueError:
+                try:
+                    return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+                except (TypeError, ValueError):
+                    pass
+        return self.backoff_base * 2 ** attempt + random.uniform(0, self.backoff_base)
+    
+    def get(self, session: requests.Session, url: str, **kwargs) -> requests.Response:
+        """GET respetando el límite del host y reintentando los 429/503"""
+        state = self._acquire_host(urlparse(url).netloc)
+        try:
+            semaphore = state[0]
+            for attempt in range(self.max_retries + 1):
+                with semaphore:
+                    wait = state[1] - time.monotonic()
+                    if wait > 0:
+                        time.sleep(wait)
+                    response = session.get(url, **kwargs)
+                
+                if response.status_code not in (429, 503) or attempt == self.max_retries:
+                    return response
+                
+                delay = self.retry_delay(response, attempt)
+                if delay > self.max_delay:
+                    print(f"{url} respondió {response.status_code} y pide esperar {delay:.0f}s; no se reintenta")
+                    return response
+                
+                response.close()  # devuelve la conexión al pool antes de esperar
+                with self.lock:
+                    state[1] = max(state[1], time.monotonic() + delay)
+                print(f"{url} respondió {response.status_code}; reintentando en {delay:.1f}s")
+            return response
+        finally:
+            self._release_host(state)
+
+# Compartido por todos los hilos que descargan páginas
+HOST_LIMITER = HostRateLimiter()
+
+class MemoCache:
+    """Memo LRU en memoria y seguro entre hilos, para no repetir trabajo dentro de una ejecución"""
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
     
-    def __call__(self, func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            now = time.time()
-            self.calls = [call for call in self.calls if call > now - 60]
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+            return value
+    
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            if len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+# Tamaño de los memos por URL de WebScrapingService
+URL_MEMO_SIZE = 10000
+PAGE_MEMO_SIZE = 256
+
+# Términos típicos de un sitio corporativo (texto completo y menús)
+CORPORATE_TERMS = (
+    'contacto', 'contact', 'quienes somos', 'about us', 'sobre nosotros',
+    'política de privacidad', 'privacy policy', 'aviso legal', 'legal notice',
+    'nuestros servicios', 'our services', 'productos', 'products'
+)
+
+@dataclass(frozen=True, slots=True)
+class CompanyTokens:
+    """
+    Datos de la empresa ya normalizados para puntuar webs: se calculan una vez por empresa
+    y no una vez por cada URL candidata
+    """
+    name: str
+    name_words: Tuple[str, ...]
+    provincia: str
+    cod_postal: str
+    nif: str
+    address: str
+    address_parts: Tuple[str, ...]
+    poblacion: str
+    # Autómata de terms(), construido una vez por empresa y reutilizado en cada URL
+    automaton: Optional[ahocorasick.Automaton] = field(default=None, compare=False, repr=False)
+    
+    @classmethod
+    def from_dict(cls, company: Dict) -> 'CompanyTokens':
+        name = company['razon_social'].lower() if company.get('razon_social') else ""
+        words = WebScrapingService.clean_company_name(name).split('-') if name else []
+        address = company['domicilio'].lower() if company.get('domicilio') else ""
+        tokens = cls(
+            name=name,
+            name_words=tuple(word for word in words if len(word) > 3),
+            provincia=company['nom_provincia'].lower() if company.get('nom_provincia') else "",
+            cod_postal=str(company['cod_postal']).strip() if company.get('cod_postal') else "",
+            nif=company['nif'].lower() if company.get('nif') else "",
+            address=address,
+            address_parts=tuple(part for part in address.split() if len(part) > 3),
+            poblacion=company['nom_poblacion'].lower() if company.get('nom_poblacion') else ""
+        )
+        return replace(tokens, automaton=build_term_automaton(tokens.terms()))
+    
+    def terms(self) -> List[str]:
+        """Todos los términos que se buscan en el texto completo de la página"""
+        return [
+            self.name, self.provincia, self.cod_postal, self.nif, self.address, self.poblacion,
+            *self.name_words, *self.address_parts, *CORPORATE_TERMS
+        ]
+
+PHONE_TEXT_TAGS = frozenset(['p', 'div', 'span', 'a'])
+
+@dataclass(slots=True)
+class PageElements:
+    """
+    Lo que extract_phones y detect_ecommerce necesitan del árbol, reunido en un único
+    recorrido en lugar de un find_all por cada tipo de elemento
+    """
+    tel_hrefs: List[str]
+    texts: Set[str]
+    links: List[Tuple[str, str]]
+    form_actions: List[str]
+    classes: List[str]
+    
+    @classmethod
+    def from_soup(cls, soup: BeautifulSoup) -> 'PageElements':
+        tel_hrefs, texts, links, form_actions, classes = [], set(), [], [], []
+        for element in soup.find_all(True):
+            name = element.name
+            attrs = element.attrs
             
-            if len(self.calls) >= self.calls_per_minute:
-                sleep_time = self.calls[0] - (now - 60)
-                if sleep_time > 0:
-                    time.sleep(sleep_time)
+            if name in PHONE_TEXT_TAGS:
+                string = element.string
+                if string:
+                    texts.add(string)
+                if name == 'a':
+                    href = attrs.get('href', '')
+                    if TEL_HREF_RE.search(href):
+                        tel_hrefs.append(href)
+                    if string is not None:
+                        links.append((element.get_text().lower(), href.lower()))
+            elif name == 'form':
+                action = attrs.get('action', '')
+                if ECOMMERCE_FORM_ACTION_RE.search(action):
+                    form_actions.append(action)
             
-            self.calls.append(now)
-            return func(*args, **kwargs)
-        return wrapper
+            element_classes = attrs.get('class')
+            if element_classes:
+                classes.extend(element_classes)
+                # Equivale al antiguo find_all(attrs=DATA_ATTR_RE), que bs4 aplica a la clase
+                if any(DATA_ATTR_RE.match(value) for value in element_classes):
+                    texts.update(value for value in attrs.values() if isinstance(value, str))
+        return cls(tel_hrefs, texts, links, form_actions, classes)
 
 class WebScrapingService:
     def __init__(self, db_params: dict):
@@ -69,14 +446,34 @@ class WebScrapingService:
         :param db_params: Parámetros de conexión a PostgreSQL
         """
         self.db_params = db_params
-        try:
-            # Conectar directamente a PostgreSQL
-            self.connection = psycopg2.connect(**db_params)
+        # Varias empresas (filiales, sedes) comparten web: el resultado de verificar cada
+        # URL y las últimas páginas descargadas se reutilizan durante la ejecución
+        self._url_memo = MemoCache(URL_MEMO_SIZE)
+        self._page_memo = MemoCache(PAGE_MEMO_SIZE)
+        # La conexión se abre en el primer uso y se reutiliza en todo el servicio;
+        # los workers que escriben vía Supabase nunca llegan a abrirla
+        self.connection = None
+    
+    def _get_connection(self):
+        """Devuelve la conexión compartida, abriéndola si no existe o se cerró"""
+        if self.connection is None or self.connection.closed:
+            self.connection = psycopg2.connect(**self.db_params)
             self.connection.autocommit = True
             logger.info("Conexión a la base de datos establecida correctamente")
-        except Exception as e:
-            logger.error(f"Error conectando a la base de datos: {str(e)}")
-            self.connection = None
+        return self.connection
+    
+    def close(self):
+        """Cierra la conexión compartida (se vuelve a abrir sola si el servicio se reutiliza)"""
+        if self.connection is not None and not self.connection.closed:
+            self.connection.close()
+            logger.info("Conexión a la base de datos cerrada")
+        self.connection = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
     
     def execute_query(self, query: str, params: tuple = None, return_df=False):
         """
@@ -84,11 +481,7 @@ class WebScrapingService:
         """
         import pandas as pd
         try:
-            if self.connection is None or self.connection.closed:
-                self.connection = psycopg2.connect(**self.db_params)
-                self.connection.autocommit = True
-                
-            with self.connection.cursor() as cursor:
+            with self._get_connection().cursor() as cursor:
                 if params:
                     cursor.execute(query, params)
                 else:
@@ -124,7 +517,8 @@ class WebScrapingService:
             results = self.execute_query(query, params=(limit,), return_df=True)
             
             if results is not None and not results.empty:
-                companies = results.to_dict('records')
+                columns = results.columns.tolist()
+                companies = [dict(zip(columns, row)) for row in results.itertuples(index=False, name=None)]
                 print(f"\nEmpresas encontradas: {len(companies)}")
                 print("Primeras 5 empresas:")
                 for company in companies[:5]:
@@ -218,16 +612,11 @@ class WebScrapingService:
         name = ''.join(c for c in unicodedata.normalize('NFKD', company_name)
                       if not unicodedata.combining(c))
         name = name.lower().strip()
-        name = re.sub(r'[^\w\s-]', '', name)
+        name = COMPANY_NAME_PUNCT_RE.sub('', name)
         name = name.replace(' ', '-')
         
-        patterns = [
-            r'(-sa|-s\.a\.|sa|sociedad-anonima|sociedad-anonyma)$',
-            r'(-sl|-s\.l\.|sl|sociedad-limitada)$'
-        ]
-        
-        for pattern in patterns:
-            name = re.sub(pattern, '', name, flags=re.IGNORECASE)
+        for pattern in LEGAL_SUFFIX_RES:
+            name = pattern.sub('', name)
         
         return name.rstrip('-')
 
@@ -368,16 +757,8 @@ class WebScrapingService:
                 headers = {
                     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/91.0.4472.124 Safari/537.36'
                 }
-                # Configurar una sesión con reintentos
-                session = requests.Session()
-                retry = Retry(
-                    total=2,
-                    backoff_factor=0.5,
-                    status_forcelist=[500, 502, 503, 504]
-                )
-                adapter = HTTPAdapter(max_retries=retry)
-                session.mount('http://', adapter)
-                session.mount('https://', adapter)
+                # Sesión compartida con reintentos
+                session = RETRY_SESSION
                 
                 # Intentar HTTPS
                 response = session.head(
@@ -440,9 +821,10 @@ class WebScrapingService:
         Verifica múltiples URLs en paralelo y devuelve los resultados con puntuación
         """
         results = {}
+        tokens = CompanyTokens.from_dict(company)
         with ThreadPoolExecutor(max_workers=4) as executor:
             future_to_url = {
-                executor.submit(self.verify_and_score_url, url, company): url 
+                executor.submit(self.verify_and_score_url, url, company, tokens): url 
                 for url in urls
             }
             for future in concurrent.futures.as_completed(future_to_url):
@@ -459,7 +841,7 @@ class WebScrapingService:
 
         return results
     
-    def verify_and_score_url(self, url: str, company: Dict) -> Tuple[bool, Dict, int]:
+    def verify_and_score_url(self, url: str, company: Dict, tokens: CompanyTokens = None) -> Tuple[bool, Dict, int]:
         """
         Verifica una URL y le asigna una puntuación
         """
@@ -468,12 +850,11 @@ class WebScrapingService:
             
             if is_valid:
                 # Obtener contenido para puntuar
-                session = requests.Session()
-                content = self.get_page_content(url, session)
+                content = self.get_page_content(url, HTTP_SESSION)
                 
                 if content:
-                    soup = BeautifulSoup(content, 'html.parser')
-                    score = self.score_website(url, soup, company)
+                    soup = BeautifulSoup(content, 'lxml')
+                    score = self.score_website(url, soup, company, content, tokens)
                     data['score'] = score
                     return True, data, score
                     
@@ -512,21 +893,24 @@ class WebScrapingService:
         
         return best_url, best_data
 
-    def score_website(self, url: str, soup: BeautifulSoup, company: Dict) -> int:
+    def score_website(self, url: str, soup: BeautifulSoup, company: Dict, html: str = None,
+                      tokens: CompanyTokens = None) -> int:
         """
         Asigna una puntuación a un sitio web basado en su relevancia para la empresa
         """
         score = 0
+        if tokens is None:
+            tokens = CompanyTokens.from_dict(company)
+        company_name = tokens.name
         
         # Obtener el texto completo y limpiarlo
-        full_text = soup.get_text().lower()
+        full_text = page_text(html, soup).lower()
+        
+        # Todos los términos a buscar en el texto completo se localizan en una sola pasada
+        present = find_terms(full_text, tokens.automaton)
         
         # 1. Verificar si el nombre de la empresa aparece en el sitio
-        if company.get('razon_social'):
-            company_name = company['razon_social'].lower()
-            clean_name = self.clean_company_name(company_name)
-            words = clean_name.split('-')
-            
+        if company_name:
             # Extraer elementos clave
             title = soup.title.text.lower() if soup.title else ""
             
@@ -547,70 +931,53 @@ class WebScrapingService:
                 score += 15  # Mayor puntuación por aparecer en elementos clave
             
             # Verificar coincidencias parciales
-            for word in words:
-                if len(word) > 3 and word in key_elements_text:
+            for word in tokens.name_words:
+                if word in key_elements_text:
                     score += 3  # Mayor puntuación por palabras en elementos clave
             
             # Para el resto del texto, mantener la lógica actual pero con menor peso
-            full_text = soup.get_text().lower()
-            if company_name in full_text:
+            if company_name in present:
                 score += 5  # Puntuación menor por aparecer en el texto general
             
-            for word in words:
-                if len(word) > 3 and word in full_text and word not in key_elements_text:
+            for word in tokens.name_words:
+                if word in present and word not in key_elements_text:
                     score += 1  # Menor puntuación para coincidencias en texto general
         
         # 2. Verificar si la provincia aparece
-        if company.get('nom_provincia'):
-            provincia = company['nom_provincia'].lower()
-            if provincia in full_text:
-                score += 5
+        if tokens.provincia in present:
+            score += 5
         
         # 3. Verificar si el código postal aparece
-        if company.get('cod_postal'):
-            cp = str(company['cod_postal']).strip()
-            if cp in full_text:
-                score += 7
+        if tokens.cod_postal in present:
+            score += 7
         
         # 4. Verificar si el NIF/CIF aparece
-        if company.get('nif'):
-            nif = company['nif'].lower()
-            if nif in full_text:
-                score += 100  # Alta puntuación, muy específico
+        if tokens.nif in present:
+            score += 100  # Alta puntuación, muy específico
         
         # 5. Verificar si la dirección aparece
-        if company.get('domicilio'):
-            direccion = company['domicilio'].lower()
-            if direccion in full_text:
+        if tokens.address:
+            if tokens.address in present:
                 score += 10
             else:
                 # Buscar partes de la dirección (número, calle, etc.)
-                parts = direccion.split()
-                for part in parts:
-                    if len(part) > 3 and part in full_text:
+                for part in tokens.address_parts:
+                    if part in present:
                         score += 2
         
         # 6. Verificar si la población aparece
-        if company.get('nom_poblacion'):
-            poblacion = company['nom_poblacion'].lower()
-            if poblacion in full_text:
-                score += 5
+        if tokens.poblacion in present:
+            score += 5
         
         # 7. Verificar elementos típicos de un sitio corporativo
-        corporate_terms = [
-            'contacto', 'contact', 'quienes somos', 'about us', 'sobre nosotros',
-            'política de privacidad', 'privacy policy', 'aviso legal', 'legal notice',
-            'nuestros servicios', 'our services', 'productos', 'products'
-        ]
-        
-        for term in corporate_terms:
-            if term in full_text:
+        for term in CORPORATE_TERMS:
+            if term in present:
                 score += 1
         
         # 8. Verificar si tiene secciones típicas en los menús
         for nav in soup.find_all(['nav', 'header']):
             nav_text = nav.get_text().lower()
-            for term in corporate_terms:
+            for term in CORPORATE_TERMS:
                 if term in nav_text:
                     score += 2  # Mayor peso en la navegación
         
@@ -626,7 +993,7 @@ class WebScrapingService:
             score += len(phones) * 2
         
         # 11. Verificar si tiene redes sociales
-        social_links = self.extract_social_links(soup)
+        social_links = self.extract_social_links(soup, html)
         social_count = sum(1 for value in social_links.values() if value)
         score += social_count * 2
         
@@ -664,14 +1031,41 @@ class WebScrapingService:
     def verify_company_url(self, url: str, company: Dict) -> Tuple[bool, Dict]:
         """
         Verifica una URL específica y extrae información.
+        Si la URL ya se verificó con éxito en esta ejecución se reutiliza el resultado sin tocar la red.
         Returns:
             Tuple[bool, Dict]: (éxito, datos extraídos)
         """
+        key = url.strip().rstrip('/') if url else url
+        if not key:
+            return self._verify_company_url(url, company)
+        if not key.lower().startswith(('http://', 'https://')):
+            key = 'https://' + key
+        # Esquema y host no distinguen mayúsculas; la ruta y la query sí
+        parts = urlsplit(key)
+        key = urlunsplit(parts._replace(netloc=parts.netloc.lower()))
+        
+        cached = self._url_memo.get(key)
+        if cached is not None:
+            print(f"♻️ URL ya verificada en esta ejecución: {url}")
+            is_valid, data = cached
+            data = copy.deepcopy(data)
+            data['cod_infotel'] = company['cod_infotel']
+            return is_valid, data
+        
+        is_valid, data = self._verify_company_url(url, company)
+        # Los fallos suelen ser transitorios (timeouts, 5xx, DNS): no se memorizan para que
+        # la siguiente empresa que comparta la URL vuelva a intentarlo
+        if is_valid:
+            self._url_memo.set(key, (is_valid, copy.deepcopy(data)))
+        return is_valid, data
+
+    def _verify_company_url(self, url: str, company: Dict) -> Tuple[bool, Dict]:
+        """Verificación de una URL contra la red (ver verify_company_url)"""
         print(f"\n{'='*50}")
         print(f"🚀 Iniciando verify_company_url para: {company['razon_social']}")
         print(f"🌍 URL original: {url}")
 
-        session = requests.Session()
+        session = HTTP_SESSION
 
         try:
             # Estructura inicial de datos
@@ -769,91 +1163,8 @@ class WebScrapingService:
                         except:
                             pass
             
-            # Método 3: Verificación HTTP como último recurso
-            if not domain_exists:
-                headers = {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/91.0.4472.124 Safari/537.36'
-                }
-                try:
-                    # Configurar una sesión con reintentos
-                    retry_session = requests.Session()
-                    retry = Retry(
-                        total=2,
-                        backoff_factor=0.5,
-                        status_forcelist=[500, 502, 503, 504]
-                    )
-                    adapter = HTTPAdapter(max_retries=retry)
-                    retry_session.mount('http://', adapter)
-                    retry_session.mount('https://', adapter)
-                    
-                    # Intentar HTTPS
-                    print(f"Intentando verificación HTTPS para {base_domain}...")
-                    response = retry_session.head(
-                        f"https://{base_domain}", 
-                        timeout=5, 
-                        headers=headers, 
-                        allow_redirects=True,
-                        verify=False
-                    )
-                    if response.status_code < 500:  # Aceptar incluso códigos de error como 403, 404
-                        print(f"✅ Dominio válido mediante petición HTTPS: {base_domain} (Status: {response.status_code})")
-                        domain_exists = True
-                except Exception as e:
-                    print(f"❌ Error con petición HTTPS: {type(e).__name__}")
-                    # Intentar con HTTP
-                    try:
-                        print(f"Intentando verificación HTTP para {base_domain}...")
-                        response = retry_session.head(
-                            f"http://{base_domain}", 
-                            timeout=5, 
-                            headers=headers, 
-                            allow_redirects=True,
-                            verify=False
-                        )
-                        if response.status_code < 500:
-                            print(f"✅ Dominio válido mediante petición HTTP: {base_domain} (Status: {response.status_code})")
-                            domain_exists = True
-                    except Exception as e:
-                        print(f"❌ Error con petición HTTP: {type(e).__name__}")
-                        # Intentar con www si no lo tiene
-                        if not domain.startswith('www.'):
-                            try:
-                                print(f"Intentando verificación HTTPS para www.{base_domain}...")
-                                response = retry_session.head(
-                                    f"https://www.{base_domain}", 
-                                    timeout=5, 
-                                    headers=headers, 
-                                    allow_redirects=True,
-                                    verify=False
-                                )
-                                if response.status_code < 500:
-                                    print(f"✅ Dominio válido mediante petición HTTPS con www: www.{base_domain} (Status: {response.status_code})")
-                                    domain_exists = True
-                            except Exception as e:
-                                print(f"❌ Error con petición HTTPS con www: {type(e).__name__}")
-                                try:
-                                    print(f"Intentando verificación HTTP para www.{base_domain}...")
-                                    response = retry_session.head(
-                                        f"http://www.{base_domain}", 
-                                        timeout=5, 
-                                        headers=headers, 
-                                        allow_redirects=True,
-                                        verify=False
-                                    )
-                                    if response.status_code < 500:
-                                        print(f"✅ Dominio válido mediante petición HTTP con www: www.{base_domain} (Status: {response.status_code})")
-                                        domain_exists = True
-                                except Exception as e:
-                                    print(f"❌ Error con petición HTTP con www: {type(e).__name__}")
-
-            if not domain_exists:
-                data.update({
-                    'url_status': -1,
-                    'url_status_mensaje': "Dominio no válido"
-                })
-                return False, data
-
-            # Intentar obtener el contenido de la página
+            # Método 3: Verificación HTTP como último recurso. La propia descarga de la
+            # página sirve de comprobación: un único GET en lugar de varios HEAD y luego el GET
             print("📡 Intentando obtener contenido de la página...")
             content = self.get_page_content(url, session)
 
@@ -861,14 +1172,14 @@ class WebScrapingService:
                 print("❌ No se pudo obtener contenido")
                 data.update({
                     'url_status': -1,
-                    'url_status_mensaje': "No se pudo acceder a la URL"
+                    'url_status_mensaje': "No se pudo acceder a la URL" if domain_exists else "Dominio no válido"
                 })
                 return False, data
 
             print("✅ Contenido obtenido correctamente. URL válida!")
 
             # Procesar contenido HTML con BeautifulSoup
-            soup = BeautifulSoup(content, 'html.parser')
+            soup = BeautifulSoup(content, 'lxml')
 
             # Extraer información básica
             data.update({
@@ -879,17 +1190,19 @@ class WebScrapingService:
             })
 
             # Extraer teléfonos
-            phones = self.extract_phones(soup)
+            # Un único recorrido del árbol para teléfonos y ecommerce
+            elements = PageElements.from_soup(soup)
+            phones = self.extract_phones(soup, elements)
             print(f"📞 Teléfonos extraídos: {phones}")
             data['phones'] = phones
 
             # Extraer redes sociales
-            social_links = self.extract_social_links(soup)
+            social_links = self.extract_social_links(soup, content)
             print(f"📲 Redes sociales extraídas: {json.dumps(social_links, indent=2)}")
             data['social_media'].update(social_links)
 
             # Detectar e-commerce
-            is_ecommerce, ecommerce_data = self.detect_ecommerce(soup)
+            is_ecommerce, ecommerce_data = self.detect_ecommerce(soup, content, elements)
             data['is_ecommerce'] = is_ecommerce  # Solo el booleano
             data['ecommerce_data'] = ecommerce_data  # Guarda detalles adicionales si los necesitas
             print(f"🛒 E-commerce detectado: {is_ecommerce}")
@@ -905,43 +1218,92 @@ class WebScrapingService:
             })
             return False, data
 
-        finally:
-            session.close()
-
-    @RateLimiter(calls_per_minute=30)
     def get_page_content(self, url: str, session: requests.Session) -> str:
-        """Obtiene el contenido de una página web con rate limiting"""
+        """Obtiene el contenido de una página web, de memoria o de la caché de Redis si ya se descargó"""
+        content = self._page_memo.get(url)
+        if content is not None:
+            return content
+        
+        content = get_cached_page(url)
+        if content is not None:
+            print(f"Contenido de {url} obtenido de la caché")
+        else:
+            content = self._fetch_page_content(url, session)
+            if content is not None:
+                save_cached_page(url, content)
+        
+        if content is not None:
+            self._page_memo.set(url, content)
+        return content
+
+    def _fetch_page_content(self, url: str, session: requests.Session) -> str:
+        """Descarga el contenido de una página web con rate limiting por host (HOST_LIMITER)"""
         headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/91.0.4472.124 Safari/537.36'
         }
         
         try:
             print(f"Intentando acceder a {url}...")
-            response = session.get(
+            response = HOST_LIMITER.get(
+                session,
                 url, 
                 timeout=(10, 20),
                 verify=False,
-                headers=headers
+                headers=headers,
+                stream=True
             )
-            response.raise_for_status()
+            with response:
+                response.raise_for_status()
+                content = self._read_capped(response)
             print(f"Acceso exitoso a {url}")
-            return response.text
+            return self._decode_page(response, content)
         except Exception as e:
             print(f"Error accediendo a {url}: {str(e)}")
             return None
         
-    def extract_phones(self, soup: BeautifulSoup) -> List[str]:
+    @staticmethod
+    def _read_capped(response: requests.Response) -> bytes:
+        """Lee el cuerpo por bloques hasta MAX_PAGE_BYTES y deja el resto sin descargar"""
+        buffer = bytearray()
+        for chunk in response.iter_content(PAGE_CHUNK_SIZE):
+            buffer += chunk
+            if len(buffer) >= MAX_PAGE_BYTES:
+                print(f"Página truncada a {MAX_PAGE_BYTES} bytes: {response.url}")
+                del buffer[MAX_PAGE_BYTES:]
+                break
+        return bytes(buffer)
+    
+    @staticmethod
+    def _decode_page(response: requests.Response, content: bytes) -> str:
+        """
+        Decodifica el HTML en una sola pasada sin detección de charset sobre el cuerpo completo.
+        Orden: charset de la cabecera HTTP, <meta charset> en los primeros bytes, UTF-8.
+        """
+        encoding = None
+        if 'charset' in response.headers.get('Content-Type', '').lower():
+            encoding = response.encoding
+        if not encoding:
+            match = META_CHARSET_RE.search(content, 0, META_CHARSET_WINDOW)
+            if match:
+                encoding = match.group(1).decode('ascii')
+        try:
+            return content.decode(encoding or 'utf-8', errors='replace')
+        except LookupError:
+            return content.decode('utf-8', errors='replace')
+
+    def extract_phones(self, soup: BeautifulSoup, elements: PageElements = None) -> List[str]:
         """
         Extrae teléfonos de una página web usando BeautifulSoup
         """
         phones = set()  # Usamos set para evitar duplicados
 
         try:
+            if elements is None:
+                elements = PageElements.from_soup(soup)
+            
             # 1. Buscar enlaces tipo tel:
-            tel_links = soup.find_all('a', href=re.compile(r'^tel:'))
-            for link in tel_links:
-                href = link.get('href', '')
-                phone = re.sub(r'[^\d+]', '', href.replace('tel:', ''))
+            for href in elements.tel_hrefs:
+                phone = NON_PHONE_CHARS_RE.sub('', href.replace('tel:', ''))
                 if phone.startswith('+'):
                     phones.add(phone)
                 elif phone.startswith('34'):
@@ -949,31 +1311,23 @@ class WebScrapingService:
                 elif len(phone) == 9:  # Número español sin prefijo
                     phones.add(f"+34{phone}")
 
-            # 2. Buscar en el texto con patrón mejorado
-            phone_pattern = r'(?:\+34|0034|34)?[\s-]?(?:[\s-]?\d){9}'
-
-            # Buscar teléfonos en elementos de texto
-            for element in soup.find_all(['p', 'div', 'span', 'a']):
-                if element.string:
-                    found_phones = re.findall(phone_pattern, element.string)
-                    for phone in found_phones:
-                        clean_phone = re.sub(r'[^\d]', '', phone)
-                        if len(clean_phone) == 9:
-                            phones.add(f"+34{clean_phone}")
-                        elif len(clean_phone) > 9:
-                            phones.add(f"+{clean_phone}")
-
-            # 3. Buscar en atributos data-* que podrían contener teléfonos
-            for element in soup.find_all(attrs=re.compile(r'^data-')):
-                for attr_name, attr_value in element.attrs.items():
-                    if isinstance(attr_value, str):
-                        found_phones = re.findall(phone_pattern, attr_value)
-                        for phone in found_phones:
-                            clean_phone = re.sub(r'[^\d]', '', phone)
-                            if len(clean_phone) == 9:
-                                phones.add(f"+34{clean_phone}")
-                            elif len(clean_phone) > 9:
-                                phones.add(f"+{clean_phone}")
+            # 2. Textos candidatos: elementos de texto y atributos data-* que podrían
+            # contener teléfonos. Un mismo texto aparece en varios elementos anidados
+            # (div > span), así que PageElements ya los trae deduplicados
+            texts = elements.texts
+
+            # 3. Una sola pasada de PHONE_RE sobre todos los textos; '|' no es dígito,
+            # espacio ni guion, así que ningún número se forma entre dos textos.
+            # Si entre todos no suman 9 dígitos no puede haber teléfono: no se lanza el regex
+            joined = '|'.join(texts)
+            if sum(joined.count(digit) for digit in ASCII_DIGITS) < 9:
+                return list(phones)[:3]
+            for phone in PHONE_RE.findall(joined):
+                clean_phone = phone.translate(PHONE_STRIP_TABLE)
+                if len(clean_phone) == 9:
+                    phones.add(f"+34{clean_phone}")
+                elif len(clean_phone) > 9:
+                    phones.add(f"+{clean_phone}")
 
             # Convertir el set a lista y limitar a 3 teléfonos
             return list(phones)[:3]
@@ -982,9 +1336,10 @@ class WebScrapingService:
             logger.error(f"Error extrayendo teléfonos: {e}")
             return []
 
-    def extract_social_links(self, soup: BeautifulSoup) -> Dict[str, str]:
+    def extract_social_links(self, soup: BeautifulSoup, html: str = None) -> Dict[str, str]:
         """
-        Extrae enlaces a redes sociales de una página web
+        Extrae enlaces a redes sociales de una página web.
+        Con el HTML en bruto basta una pasada de SOCIAL_HREF_RE, sin recorrer el árbol de BeautifulSoup
         """
         try:
             social_links = {
@@ -995,28 +1350,38 @@ class WebScrapingService:
                 'youtube': ''
             }
 
-            # Patrones mejorados para redes sociales
-            social_patterns = {
-                'facebook': r'facebook\.com/(?!sharer|share)([^/?&]+)',
-                'twitter': r'twitter\.com/(?!share|intent)([^/?&]+)',
-                'instagram': r'instagram\.com/([^/?&]+)',
-                'linkedin': r'linkedin\.com/(?:company|in)/([^/?&]+)',
-                'youtube': r'youtube\.com/(?:user|channel|c)/([^/?&]+)'
-            }
+            # Con el HTML en bruto basta el regex; si no, se recorren los enlaces del árbol
+            if html is not None:
+                # En el HTML en bruto las entidades (&amp;...) siguen sin decodificar
+                hrefs = (unescape(match.group(1)) for match in SOCIAL_HREF_RE.finditer(html))
+            else:
+                hrefs = (link['href'] for link in soup.find_all('a', href=True))
 
-            # Buscar enlaces de redes sociales
-            for link in soup.find_all('a', href=True):
-                href = link['href'].lower()
+            # Una sola pasada: cada red se queda con su primer enlace y se deja de
+            # buscar en cuanto están todas
+            pending = dict(SOCIAL_PATTERNS)
+            for href in hrefs:
+                href = href.lower()
 
                 # Ignorar links de compartir
                 if 'sharer' in href or 'share?' in href or 'intent/tweet' in href:
                     continue
 
-                for network, pattern in social_patterns.items():
-                    if network in href:
-                        match = re.search(pattern, href)
-                        if match:
-                            social_links[network] = href
+                # Red del enlace según su dominio (www., es., m.... no cuentan). Los href
+                # sin esquema ni // ("facebook.com/empresa") se leen como dominio/ruta;
+                # si no lo son, su primer tramo no coincide con ninguna red y se descartan
+                host = urlparse(href).hostname
+                if not host and not href.startswith(('/', '.', '#', '?')):
+                    host = urlparse(f'https://{href}').hostname
+                if not host:
+                    continue
+                network = SOCIAL_NETWORK_BY_DOMAIN.get('.'.join(host.rsplit('.', 2)[-2:]))
+                if network in pending and pending[network].search(href):
+                    social_links[network] = href
+                    del pending[network]
+
+                if not pending:
+                    break
 
             return social_links
 
@@ -1030,56 +1395,40 @@ class WebScrapingService:
                 'youtube': ''
             }
             
-    def detect_ecommerce(self, soup: BeautifulSoup) -> Tuple[bool, Dict]:
+    def detect_ecommerce(self, soup: BeautifulSoup, html: str = None,
+                         elements: PageElements = None) -> Tuple[bool, Dict]:
         """Detecta si una web tiene comercio electrónico"""
-        ecommerce_indicators = {
-            'carrito_compra': [
-                'carrito', 'cart', 'cesta', 'basket', 'shopping', 'comprar'
-            ],
-            'botones_compra': [
-                'añadir al carrito', 'add to cart', 'comprar ahora', 'buy now',
-                'realizar pedido', 'checkout', 'agregar al carrito', 'comprar', 'tienda online'
-            ],
-            'elementos_tienda': [
-                'tienda', 'shop', 'store', 'catálogo', 'catalog', 'productos', 'products'
-            ]
-        }
-        
         score = 0
         evidence = []
+        if elements is None:
+            elements = PageElements.from_soup(soup)
         
         # Buscar en enlaces
-        for link in soup.find_all('a', string=True):
-            text = link.get_text().lower()
-            href = link.get('href', '').lower()
-            
-            for category, indicators in ecommerce_indicators.items():
-                for indicator in indicators:
-                    if indicator in text or indicator in href:
-                        score += 1
-                        evidence.append(f"Enlace encontrado: {text if text else href}")
-                        break
+        for text, href in elements.links:
+            for category_re in ECOMMERCE_LINK_RES:
+                if category_re.search(text) or category_re.search(href):
+                    score += 1
+                    evidence.append(f"Enlace encontrado: {text if text else href}")
         
         # Buscar formularios de compra
-        forms = soup.find_all('form')
-        for form in forms:
-            action = form.get('action', '').lower()
-            if any(term in action for term in ['cart', 'checkout', 'payment', 'compra', 'pago']):
-                score += 2
-                evidence.append(f"Formulario de compra encontrado: {action}")
+        for action in elements.form_actions:
+            score += 2
+            evidence.append(f"Formulario de compra encontrado: {action.lower()}")
         
         # Buscar elementos con clases/IDs típicos de ecommerce
-        ecommerce_classes = ['cart', 'checkout', 'basket', 'shop', 'store', 'product', 'price']
-        for class_name in ecommerce_classes:
-            elements = soup.find_all(class_=re.compile(class_name))
-            if elements:
+        found_classes = set()
+        for value in elements.classes:
+            found_classes.update(ECOMMERCE_CLASS_RE.findall(value))
+            if len(found_classes) == len(ECOMMERCE_CLASS_NAMES):
+                break
+        for class_name in ECOMMERCE_CLASS_NAMES:
+            if class_name in found_classes:
                 score += 1
                 evidence.append(f"Elementos con clase '{class_name}' encontrados")
         
         # Buscar símbolos de moneda y precios
-        price_pattern = r'(?:€|EUR)\s*\d+(?:[.,]\d{2})?|\d+(?:[.,]\d{2})?\s*(?:€|EUR)'
-        text_content = soup.get_text()
-        prices = re.findall(price_pattern, text_content, re.IGNORECASE)
+        text_content = page_text(html, soup)
+        prices = PRICE_RE.findall(text_content)
         if prices:
             score += 0.5
             evidence.append(f"Precios encontrados: {len(prices)} ocurrencias")
@@ -1090,91 +1439,181 @@ class WebScrapingService:
             'evidence': evidence
         }
 
-    def update_company_data(self, company_id: int, data: Dict) -> Dict[str, Any]:
-        """Actualiza los datos de la empresa en la base de datos"""
+    @staticmethod
+    def _company_update_params(company_id: int, data: Dict) -> tuple:
+        """Valores de actualización de una empresa, en el orden de las columnas del UPDATE"""
+        phones = data.get('phones', [])
+        phones = phones + ['', '', '']  # Asegurar que hay al menos 3 elementos
+        
+        social_media = data.get('social_media', {})
+        
+        return (
+            data.get('url_exists', False),
+            data.get('url_valida', ''),
+            data.get('url_limpia', ''),
+            data.get('url_status', -1),
+            data.get('url_status_mensaje', ''),
+            phones[0],
+            phones[1],
+            phones[2],
+            social_media.get('facebook', ''),
+            social_media.get('twitter', ''),
+            social_media.get('linkedin', ''),
+            social_media.get('instagram', ''),
+            social_media.get('youtube', ''),
+            data.get('is_ecommerce', False),
+            company_id
+        )
+
+    def update_companies_data(self, updates: List[Tuple[int, Dict]]) -> Set[int]:
+        """
+        Actualiza varias empresas con un único UPDATE ... FROM (VALUES ...) en una transacción.
+        Devuelve los cod_infotel que se actualizaron
+        """
+        if not updates:
+            return set()
+        
+        update_query = """
+        UPDATE sociedades s
+        SET 
+            url_exists = v.url_exists,
+            url_valida = v.url_valida,
+            url_limpia = v.url_limpia,
+            url_status = v.url_status,
+            url_status_mensaje = v.url_status_mensaje,
+            telefono_1 = v.telefono_1,
+            telefono_2 = v.telefono_2,
+            telefono_3 = v.telefono_3,
+            facebook = v.facebook,
+            twitter = v.twitter,
+            linkedin = v.linkedin,
+            instagram = v.instagram,
+            youtube = v.youtube,
+            e_commerce = v.e_commerce,
+            processed = TRUE,
+            fecha_actualizacion = NOW()
+        FROM (VALUES %s) AS v(
+            url_exists, url_valida, url_limpia, url_status, url_status_mensaje,
+            telefono_1, telefono_2, telefono_3,
+            facebook, twitter, linkedin, instagram, youtube,
+            e_commerce, cod_infotel
+        )
+        WHERE s.cod_infotel = v.cod_infotel
+        RETURNING s.cod_infotel
+        """
+        # Tipos explícitos: en VALUES un NULL o un literal sin tipo se resolvería como texto
+        template = (
+            "(%s::boolean, %s, %s, %s::integer, %s, %s, %s, %s, "
+            "%s, %s, %s, %s, %s, %s::boolean, %s::integer)"
+        )
+        values = [self._company_update_params(company_id, data) for company_id, data in updates]
+        
+        connection = self._get_connection()
+        connection.autocommit = False
         try:
-            print(f"\nActualizando datos para empresa {company_id}")
-            
-            # Crear query de actualización
-            update_query = """
-            UPDATE sociedades 
-            SET 
-                url_exists = %s,
-                url_valida = %s,
-                url_limpia = %s,
-                url_status = %s,
-                url_status_mensaje = %s,
-                telefono_1 = %s,
-                telefono_2 = %s,
-                telefono_3 = %s,
-                facebook = %s,
-                twitter = %s,
-                linkedin = %s,
-                instagram = %s,
-                youtube = %s,
-                e_commerce = %s,
-                processed = TRUE,
-                fecha_actualizacion = NOW()
-            WHERE cod_infotel = %s
-            """
-            
-            # Preparar los parámetros
-            phones = data.get('phones', [])
-            phones = phones + ['', '', '']  # Asegurar que hay al menos 3 elementos
-            
-            social_media = data.get('social_media', {})
-            
-            params = (
-                data.get('url_exists', False),
-                data.get('url_valida', ''),
-                data.get('url_limpia', ''),
-                data.get('url_status', -1),
-                data.get('url_status_mensaje', ''),
-                phones[0],
-                phones[1],
-                phones[2],
-                social_media.get('facebook', ''),
-                social_media.get('twitter', ''),
-                social_media.get('linkedin', ''),
-                social_media.get('instagram', ''),
-                social_media.get('youtube', ''),
-                data.get('is_ecommerce', False),
-                company_id
-            )
-            
-            # Ejecutar query
-            with self.connection.cursor() as cursor:
-                cursor.execute(update_query, params)
-                
-                if cursor.rowcount > 0:
-                    self.connection.commit()
-                    print(f"✅ Empresa {company_id} actualizada exitosamente")
-                    return {
-                        "status": "success",
-                        "message": f"Empresa {company_id} actualizada exitosamente"
-                    }
-                else:
-                    print(f"⚠️ No se actualizó la empresa {company_id}. Posible error de ID.")
-                    return {
-                        "status": "error",
-                        "message": f"No se encontró la empresa con ID {company_id}"
-                    }
-                    
+            with connection.cursor() as cursor:
+                rows = execute_values(
+                    cursor, update_query, values,
+                    template=template, page_size=len(values), fetch=True
+                )
+            connection.commit()
+            print(f"✅ {len(rows)} de {len(values)} empresas actualizadas en un único UPDATE")
+            return {row[0] for row in rows}
         except Exception as e:
-            print(f"❌ Error actualizando empresa {company_id}: {str(e)}")
+            connection.rollback()
+            print(f"❌ Error actualizando lote de {len(values)} empresas: {str(e)}")
             traceback.print_exc()
-            
-            if self.connection and not self.connection.closed:
-                self.connection.rollback()
-                
-            return {
-                "status": "error",
-                "message": str(e)
-            }
+            raise
+        finally:
+            connection.autocommit = True
+
+    def _scrape_company(self, company: Dict) -> Tuple[bool, Dict, Exception]:
+        """Rastrea una empresa sin tocar la BD; devuelve la excepción en lugar de lanzarla"""
+        try:
+            print(f"\nProcesando empresa: {company['razon_social']} (ID: {company['cod_infotel']})")
+            success, data = self.process_company(company)
+            return success, data, None
+        except Exception as e:
+            return False, None, e
+
+    def iter_companies_to_process(self, itersize: int = 500):
+        """
+        Recorre todas las empresas pendientes con un cursor de servidor (named cursor):
+        se traen de itersize en itersize filas, con memoria constante sea cual sea el tamaño
+        de la tabla. Usa su propia conexión para no chocar con las escrituras del servicio.
+        El cursor es WITH HOLD: la transacción que lo declara se confirma enseguida y no
+        queda abierta durante toda la ejecución mientras se actualizan esas mismas filas
+        """
+        query = """
+            SELECT cod_infotel, nif, razon_social, domicilio, 
+                cod_postal, nom_poblacion, nom_provincia, url
+            FROM sociedades 
+            WHERE processed = FALSE OR processed IS NULL
+        """
+        connection = psycopg2.connect(**self.db_params)
+        try:
+            with connection.cursor(name='companies_to_process', withhold=True) as cursor:
+                cursor.itersize = itersize
+                cursor.execute(query)
+                connection.commit()
+                columns = None
+                for row in cursor:
+                    if columns is None:
+                        columns = [desc[0] for desc in cursor.description]
+                    yield dict(zip(columns, row))
+        finally:
+            connection.close()
+
+    def process_pending(self, batch_size: int = 500) -> Dict[str, Any]:
+        """
+        Procesa todas las empresas pendientes en lotes de batch_size a medida que llegan
+        del cursor de servidor; cada lote se escribe (y confirma) con su propio UPDATE
+        """
+        totals = {'total': 0, 'processed': 0, 'successful': 0, 'failed': 0}
+        companies = self.iter_companies_to_process(itersize=batch_size)
+        while True:
+            batch = list(islice(companies, batch_size))
+            if not batch:
+                break
+            results = self.process_companies(batch)
+            for key in totals:
+                totals[key] += results[key]
+            print(f"Total acumulado: {totals['processed']} empresas procesadas")
+        return totals
 
     def process_batch(self, limit: int = 100) -> Dict[str, Any]:
         """Procesa un lote de empresas siguiendo el flujo completo"""
-        companies = self.get_companies_to_process(limit)
+        return self.process_companies(self.get_companies_to_process(limit))
+
+    def _flush_updates(self, updates: List[Tuple[int, Dict]]) -> Tuple[Set[int], Dict[int, str]]:
+        """
+        Guarda las actualizaciones en tramos de UPDATE_CHUNK_SIZE. Si un tramo falla se
+        reintenta fila a fila, para que una sola empresa problemática no obligue a
+        rastrear de nuevo todo el lote. Devuelve los ids actualizados y el error de los que no
+        """
+        updated_ids = set()
+        errors = {}
+        for start in range(0, len(updates), UPDATE_CHUNK_SIZE):
+            chunk = updates[start:start + UPDATE_CHUNK_SIZE]
+            try:
+                updated_ids |= self.update_companies_data(chunk)
+                continue
+            except Exception as e:
+                print(f"⚠️ Reintentando fila a fila {len(chunk)} empresas: {str(e)}")
+            
+            for company_id, data in chunk:
+                try:
+                    updated_ids |= self.update_companies_data([(company_id, data)])
+                except Exception as e:
+                    errors[company_id] = str(e)
+        return updated_ids, errors
+
+    def process_companies(self, companies: List[Dict]) -> Dict[str, Any]:
+        """Rastrea las empresas dadas y guarda sus resultados con UPDATE por tramos"""
+        # El rastreo es casi todo espera de red, así que las empresas se procesan en paralelo;
+        # las escrituras en BD se hacen después en este hilo, dueño de la conexión
+        with ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS) as executor:
+            outcomes = list(executor.map(self._scrape_company, companies))
         
         results = {
             'total': len(companies),
@@ -1184,97 +1623,100 @@ class WebScrapingService:
             'details': []
         }
         
-        for company in companies:
-            try:
-                print(f"\nProcesando empresa: {company['razon_social']} (ID: {company['cod_infotel']})")
-                
-                # Verificar la URL original
-                success, data = self.process_company(company)
-                
-                # IMPORTANTE: Siempre marcar como procesado, independientemente del resultado
-                if success:
-                    # Caso exitoso - se encontró una URL válida
-                    update_result = self.update_company_data(company['cod_infotel'], data)
-                    
-                    if update_result.get('status') == 'success':
-                        results['successful'] += 1
-                        detail = {
-                            'cod_infotel': company['cod_infotel'],
-                            'razon_social': company['razon_social'],
-                            'success': True,
-                            'url': data.get('url_valida', None),
-                            'phones': len(data.get('phones', [])),
-                            'social_networks': sum(1 for v in data.get('social_media', {}).values() if v),
-                            'is_ecommerce': data.get('is_ecommerce', False)
-                        }
-                    else:
-                        results['failed'] += 1
-                        detail = {
-                            'cod_infotel': company['cod_infotel'],
-                            'razon_social': company['razon_social'],
-                            'success': False,
-                            'error': update_result.get('message', 'Error al actualizar en BD')
-                        }
-                else:
-                    # Caso fallido - no se encontró URL válida
-                    # PERO aún así marcamos como procesado con processed = TRUE
-                    empty_data = {
-                        'cod_infotel': company['cod_infotel'],
-                        'url_exists': False,
-                        'url_status': -1,
-                        'url_status_mensaje': data.get('url_status_mensaje', 'URL no válida'),
-                        'processed': True  # Asegurarse de que este campo esté presente y sea TRUE
-                    }
-                    self.update_company_data(company['cod_infotel'], empty_data)
-                    
-                    results['failed'] += 1
-                    detail = {
-                        'cod_infotel': company['cod_infotel'],
-                        'razon_social': company['razon_social'],
-                        'success': False,
-                        'error': data.get('url_status_mensaje', 'URL no válida')
-                    }
-                
-                results['details'].append(detail)
-                
-            except Exception as e:
-                print(f"❌ Error procesando empresa {company['cod_infotel']}: {str(e)}")
-                traceback.print_exc()
-                
-                # También marcar como procesada en caso de error
-                empty_data = {
-                    'cod_infotel': company['cod_infotel'],
-                    'url_exists': False,
-                    'url_status': -1,
-                    'url_status_mensaje': str(e),
-                    'processed': True  # Asegurarse de que este campo esté presente y sea TRUE
-                }
-                try:
-                    self.update_company_data(company['cod_infotel'], empty_data)
-                except Exception as update_error:
-                    print(f"Error secundario al actualizar estado: {str(update_error)}")
-                
-                results['failed'] += 1
-                results['details'].append({
+        # Acumular las actualizaciones y el detalle de cada empresa para escribirlas por tramos
+        updates = []
+        details = []
+        for company, (success, data, scrape_error) in zip(companies, outcomes):
+            if scrape_error is None and success:
+                # Caso exitoso - se encontró una URL válida
+                updates.append((company['cod_infotel'], data))
+                details.append({
                     'cod_infotel': company['cod_infotel'],
                     'razon_social': company['razon_social'],
-                    'success': False,
-                    'error': str(e)
+                    'success': True,
+                    'url': data.get('url_valida', None),
+                    'phones': len(data.get('phones', [])),
+                    'social_networks': sum(1 for v in data.get('social_media', {}).values() if v),
+                    'is_ecommerce': data.get('is_ecommerce', False)
                 })
-                
-            finally:
-                results['processed'] += 1
-                # Mostrar progreso
-                print(f"Progreso: {results['processed']}/{results['total']}")
-                
+                continue
+            
+            if scrape_error is not None:
+                print(f"❌ Error procesando empresa {company['cod_infotel']}: {str(scrape_error)}")
+                traceback.print_exception(type(scrape_error), scrape_error, scrape_error.__traceback__)
+                error = str(scrape_error)
+            else:
+                # Caso fallido - no se encontró URL válida
+                error = data.get('url_status_mensaje', 'URL no válida')
+            
+            # IMPORTANTE: Siempre marcar como procesado, independientemente del resultado
+            updates.append((company['cod_infotel'], {
+                'cod_infotel': company['cod_infotel'],
+                'url_exists': False,
+                'url_status': -1,
+                'url_status_mensaje': error,
+                'processed': True  # Asegurarse de que este campo esté presente y sea TRUE
+            }))
+            details.append({
+                'cod_infotel': company['cod_infotel'],
+                'razon_social': company['razon_social'],
+                'success': False,
+                'error': error
+            })
+        
+        updated_ids, update_errors = self._flush_updates(updates)
+        
+        for detail in details:
+            if detail['success'] and detail['cod_infotel'] not in updated_ids:
+                detail = {
+                    'cod_infotel': detail['cod_infotel'],
+                    'razon_social': detail['razon_social'],
+                    'success': False,
+                    'error': update_errors.get(
+                        detail['cod_infotel'],
+                        f"No se encontró la empresa con ID {detail['cod_infotel']}"
+                    )
+                }
+            
+            if detail['success']:
+                results['successful'] += 1
+            else:
+                results['failed'] += 1
+            results['details'].append(detail)
+            results['processed'] += 1
+        
+        print(f"Progreso: {results['processed']}/{results['total']}")
         return results
 
 def main():
+    parser = argparse.ArgumentParser(description="Scraping de las webs de las empresas pendientes")
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=10,
+        help="Empresas del lote a procesar (default: 10)"
+    )
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help="Recorrer todas las empresas pendientes por lotes en lugar de un único lote"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=500,
+        help="Empresas por lote con --all (default: 500)"
+    )
+    args = parser.parse_args()
+    
     # Usar la configuración de la base de datos desde config.py
     from config import DB_CONFIG
     
-    scraper = WebScrapingService(DB_CONFIG)
-    results = scraper.process_batch(limit=10)
+    with WebScrapingService(DB_CONFIG) as scraper:
+        if args.all:
+            results = scraper.process_pending(batch_size=args.batch_size)
+        else:
+            results = scraper.process_batch(limit=args.limit)
     print(f"Resultados del procesamiento: {json.dumps(results, indent=2)}")
 
 if __name__ == "__main__":
@@ -1,4 +1,4 @@
-import json
+import orjson
 import time
 import uuid
 
@@ -15,8 +15,10 @@ class Task:
         self.result = None
         self.error = None
     
-    def to_json(self):
-        return json.dumps({
+    def to_bytes(self):
+        # orjson serializa/parsea bastante más rápido que json en la ruta caliente de las colas;
+        # los bytes van tal cual a Redis, sin pasar por str y volver a codificar
+        return orjson.dumps({
             "task_id": self.task_id,
             "company_id": self.company_id,
             "company_data": self.company_data,
@@ -29,9 +31,12 @@ class Task:
             "error": self.error
         })
     
+    def to_json(self):
+        return self.to_bytes().decode()
+    
     @classmethod
     def from_json(cls, json_str):
-        data = json.loads(json_str)
+        data = orjson.loads(json_str)
         task = cls(
             company_id=data.get("company_id"),
             company_data=data.get("company_data"),
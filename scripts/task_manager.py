@@ -4,6 +4,7 @@ import redis
 import logging
 import socket
 import os
+from functools import lru_cache
 from typing import List, Dict, Any, Optional
 from task import Task
 from redis_config import *
@@ -14,39 +15,82 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+@lru_cache(maxsize=None)
+def get_connection_pool(client_name: Optional[str] = None, url: Optional[str] = None,
+                        decode_responses: bool = True,
+                        socket_timeout: Optional[float] = None) -> redis.ConnectionPool:
+    """
+    Pool de conexiones compartido por proceso (uno por combinación de argumentos): los
+    TaskManager que se creen después (p. ej. en cada recarga del dashboard) reutilizan las
+    conexiones abiertas en lugar de repetir el handshake TCP + AUTH.
+    Las cachés pasan socket_timeout para que un Redis caído no bloquee al llamante; las colas
+    no, porque sus lecturas bloqueantes esperan más que eso. Con url se conecta a esa
+    instancia en lugar de a REDIS_HOST
+    """
+    options = dict(
+        decode_responses=decode_responses,
+        socket_keepalive=True,
+        socket_keepalive_options=REDIS_SOCKET_KEEPALIVE_OPTIONS,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        socket_connect_timeout=socket_timeout,
+        socket_timeout=socket_timeout,
+        # CLIENT SETNAME en cada conexión: en CLIENT LIST se ve qué worker es cada una
+        client_name=client_name,
+    )
+    if url:
+        return redis.ConnectionPool.from_url(url, **options)
+    return redis.ConnectionPool(
+        host=os.getenv('REDIS_HOST'),
+        port=int(os.getenv('REDIS_PORT', 6379)),  # Asegurar que sea entero
+        password=os.getenv('REDIS_PASSWORD'),
+        username=os.getenv('REDIS_USERNAME', 'default'),
+        **options
+    )
+
 class TaskManager:
     def __init__(self, worker_id=None):
         self.redis = redis.Redis(
-            host=os.getenv('REDIS_HOST'),
-            port=int(os.getenv('REDIS_PORT', 6379)),  # Asegurar que sea entero
-            password=os.getenv('REDIS_PASSWORD'),
-            username=os.getenv('REDIS_USERNAME', 'default'),
-            decode_responses=True,
+            connection_pool=get_connection_pool(worker_id.replace(' ', '_') if worker_id else None)
         )
         self.worker_id = worker_id
         
         
        
     
+    @staticmethod
+    def _publish_event(client, event: str, count: int = 1):
+        """Publica un evento de cambio de estado de las colas (en el pipeline o cliente dado)"""
+        client.publish(REDIS_EVENTS_CHANNEL, json.dumps({"event": event, "count": count}))
+    
     def enqueue_tasks(self, companies: List[Dict[str, Any]]) -> int:
         """Añade múltiples empresas a la cola de pendientes"""
-        pipeline = self.redis.pipeline()
-        
-        count = 0
-        for company in companies:
-            task = Task(company_id=company["cod_infotel"], company_data=company)
-            pipeline.lpush(REDIS_QUEUE_PENDING, task.to_json())
-            pipeline.incr(REDIS_COUNTER_PENDING)
-            count += 1
+        # Serializar todas las tareas y enviarlas en un único LPUSH con varios valores
+        payloads = [
+            Task(company_id=company["cod_infotel"], company_data=company).to_bytes()
+            for company in companies
+        ]
+        count = len(payloads)
+        if not payloads:
+            return 0
         
+        pipeline = self.redis.pipeline()
+        pipeline.lpush(REDIS_QUEUE_PENDING, *payloads)
+        pipeline.incrby(REDIS_COUNTER_PENDING, count)
+        self._publish_event(pipeline, "enqueued", count)
         pipeline.execute()
         logger.info(f"Enqueued {count} tasks")
         return count
     
-    def get_next_task(self) -> Optional[Task]:
-        """Obtiene la siguiente tarea pendiente y la marca como en procesamiento"""
-        # Usar RPOPLPUSH para mover atómicamente de pending a processing
-        task_json = self.redis.rpoplpush(REDIS_QUEUE_PENDING, REDIS_QUEUE_PROCESSING)
+    def get_next_task(self, timeout: Optional[int] = None) -> Optional[Task]:
+        """
+        Obtiene la siguiente tarea pendiente y la marca como en procesamiento.
+        Con timeout, espera bloqueado en Redis hasta que llegue una tarea o venza el plazo
+        """
+        # Usar (B)RPOPLPUSH para mover atómicamente de pending a processing
+        if timeout:
+            task_json = self.redis.brpoplpush(REDIS_QUEUE_PENDING, REDIS_QUEUE_PROCESSING, timeout=timeout)
+        else:
+            task_json = self.redis.rpoplpush(REDIS_QUEUE_PENDING, REDIS_QUEUE_PROCESSING)
         
         if not task_json:
             return None
@@ -60,7 +104,7 @@ class TaskManager:
         
         # Reemplazar en la cola de processing
         self.redis.lrem(REDIS_QUEUE_PROCESSING, 1, task_json)
-        self.redis.lpush(REDIS_QUEUE_PROCESSING, task.to_json())
+        self.redis.lpush(REDIS_QUEUE_PROCESSING, task.to_bytes())
         
         # Actualizar contadores
         self.redis.decr(REDIS_COUNTER_PENDING)
@@ -68,62 +112,175 @@ class TaskManager:
         
         # Establecer TTL para esta tarea
         self.redis.set(f"task:{task.task_id}:heartbeat", "1", ex=TASK_PROCESSING_TTL)
+        self._publish_event(self.redis, "started")
         
         logger.info(f"Starting task {task.task_id} for company {task.company_id}")
         return task
     
+    def get_next_tasks(self, count: int, timeout: Optional[int] = None) -> List[Task]:
+        """
+        Obtiene hasta `count` tareas pendientes en dos viajes a Redis:
+        uno para moverlas a processing y otro para actualizarlas.
+        Con timeout, espera bloqueado (BRPOPLPUSH) a la primera tarea si la cola está vacía
+        """
+        if count <= 0:
+            return []
+        
+        task_jsons = []
+        if timeout:
+            first = self.redis.brpoplpush(REDIS_QUEUE_PENDING, REDIS_QUEUE_PROCESSING, timeout=timeout)
+            if not first:
+                return []
+            task_jsons.append(first)
+        
+        # Mover atómicamente el resto de tareas de pending a processing
+        pipeline = self.redis.pipeline()
+        for _ in range(count - len(task_jsons)):
+            pipeline.rpoplpush(REDIS_QUEUE_PENDING, REDIS_QUEUE_PROCESSING)
+        task_jsons += [task_json for task_json in pipeline.execute() if task_json]
+        
+        if not task_jsons:
+            return []
+        
+        # Actualizar las tareas, los contadores y los heartbeats en un único envío
+        tasks = []
+        started_at = time.time()
+        pipeline = self.redis.pipeline(transaction=False)
+        for task_json in task_jsons:
+            task = Task.from_json(task_json)
+            task.status = "processing"
+            task.started_at = started_at
+            task.worker_id = self.worker_id
+            
+            pipeline.lrem(REDIS_QUEUE_PROCESSING, 1, task_json)
+            pipeline.lpush(REDIS_QUEUE_PROCESSING, task.to_bytes())
+            pipeline.set(f"task:{task.task_id}:heartbeat", "1", ex=TASK_PROCESSING_TTL)
+            tasks.append(task)
+        
+        pipeline.decrby(REDIS_COUNTER_PENDING, len(tasks))
+        pipeline.incrby(REDIS_COUNTER_PROCESSING, len(tasks))
+        self._publish_event(pipeline, "started", len(tasks))
+        pipeline.execute()
+        
+        logger.info(f"Starting {len(tasks)} tasks")
+        return tasks
+    
     def complete_task(self, task: Task, success: bool, result: Dict = None, error: str = None):
         """Marca una tarea como completada o fallida"""
-        # Eliminar de la cola de processing
-        self.redis.lrem(REDIS_QUEUE_PROCESSING, 1, task.to_json())
+        self.complete_tasks([{"task": task, "success": success, "result": result, "error": error}])
+    
+    def complete_tasks(self, completions: List[Dict[str, Any]]):
+        """
+        Marca varias tareas como completadas o fallidas en un único envío a Redis.
+        Cada elemento es un dict con las claves task, success y opcionalmente result/error
+        """
+        if not completions:
+            return
         
-        # Actualizar la tarea
-        task.completed_at = time.time()
-        task.status = "completed" if success else "failed"
-        task.result = result
-        task.error = error
-        
-        # Añadir a la cola correspondiente
-        if success:
-            self.redis.lpush(REDIS_QUEUE_COMPLETED, task.to_json())
-            self.redis.incr(REDIS_COUNTER_COMPLETED)
+        pipeline = self.redis.pipeline(transaction=False)
+        completed = failed = 0
+        
+        for completion in completions:
+            task = completion["task"]
+            success = completion["success"]
+            error = completion.get("error")
             
-            # Registrar métricas de éxito
-            processing_time = task.completed_at - task.started_at
-            self.redis.lpush(f"{REDIS_METRICS_PREFIX}processing_times", processing_time)
-            self.redis.ltrim(f"{REDIS_METRICS_PREFIX}processing_times", 0, 999)  # Mantener últimas 1000
-        else:
-            self.redis.lpush(REDIS_QUEUE_FAILED, task.to_json())
-            self.redis.incr(REDIS_COUNTER_FAILED)
+            # Eliminar de la cola de processing (con el JSON que tiene allí la tarea)
+            pipeline.lrem(REDIS_QUEUE_PROCESSING, 1, task.to_bytes())
+            
+            # Actualizar la tarea
+            task.completed_at = time.time()
+            task.status = "completed" if success else "failed"
+            task.result = completion.get("result")
+            task.error = error
             
-            # Registrar el error
-            self.redis.lpush(f"{REDIS_METRICS_PREFIX}errors", error or "Unknown error")
-            self.redis.ltrim(f"{REDIS_METRICS_PREFIX}errors", 0, 99)  # Mantener últimos 100
+            # Añadir a la cola correspondiente
+            if success:
+                pipeline.lpush(REDIS_QUEUE_COMPLETED, task.to_bytes())
+                completed += 1
+                
+                # Registrar métricas de éxito
+                processing_time = task.completed_at - task.started_at
+                pipeline.lpush(f"{REDIS_METRICS_PREFIX}processing_times", processing_time)
+            else:
+                pipeline.lpush(REDIS_QUEUE_FAILED, task.to_bytes())
+                failed += 1
+                
+                # Registrar el error
+                pipeline.lpush(f"{REDIS_METRICS_PREFIX}errors", error or "Unknown error")
+            
+            # Eliminar heartbeat
+            pipeline.delete(f"task:{task.task_id}:heartbeat")
+        
+        # Actualizar contadores y recortar métricas una sola vez por lote
+        if completed:
+            pipeline.incrby(REDIS_COUNTER_COMPLETED, completed)
+            pipeline.ltrim(f"{REDIS_METRICS_PREFIX}processing_times", 0, 999)  # Mantener últimas 1000
+        if failed:
+            pipeline.incrby(REDIS_COUNTER_FAILED, failed)
+            pipeline.ltrim(f"{REDIS_METRICS_PREFIX}errors", 0, 99)  # Mantener últimos 100
         
         # Decrementar contador de processing
-        self.redis.decr(REDIS_COUNTER_PROCESSING)
+        pipeline.decrby(REDIS_COUNTER_PROCESSING, len(completions))
+        self._publish_event(pipeline, "completed", len(completions))
         
-        # Eliminar heartbeat
-        self.redis.delete(f"task:{task.task_id}:heartbeat")
+        pipeline.execute()
         
-        logger.info(f"Task {task.task_id} marked as {'completed' if success else 'failed'}")
+        for completion in completions:
+            task = completion["task"]
+            logger.info(f"Task {task.task_id} marked as {'completed' if completion['success'] else 'failed'}")
+    
+    def release_tasks(self, tasks: List[Task]):
+        """
+        Devuelve a pending, en un único envío a Redis, tareas reservadas que no se llegaron
+        a procesar (p. ej. al detener un worker a mitad de lote)
+        """
+        if not tasks:
+            return
+        
+        pipeline = self.redis.pipeline(transaction=False)
+        payloads = []
+        for task in tasks:
+            pipeline.lrem(REDIS_QUEUE_PROCESSING, 1, task.to_bytes())
+            pipeline.delete(f"task:{task.task_id}:heartbeat")
+            
+            task.status = "pending"
+            task.started_at = None
+            task.worker_id = None
+            payloads.append(task.to_bytes())
+        
+        # Las colas se consumen por la derecha: con RPUSH en orden inverso vuelven a salir
+        # las primeras y en el mismo orden en que se reservaron
+        pipeline.rpush(REDIS_QUEUE_PENDING, *reversed(payloads))
+        pipeline.decrby(REDIS_COUNTER_PROCESSING, len(tasks))
+        pipeline.incrby(REDIS_COUNTER_PENDING, len(tasks))
+        self._publish_event(pipeline, "released", len(tasks))
+        pipeline.execute()
+        logger.info(f"Released {len(tasks)} unstarted tasks back to pending")
     
     def heartbeat(self, task: Task):
         """Actualiza el heartbeat de una tarea para evitar que expire"""
         self.redis.set(f"task:{task.task_id}:heartbeat", "1", ex=TASK_PROCESSING_TTL)
     
     def get_queue_stats(self) -> Dict[str, int]:
-        """Obtiene estadísticas sobre las colas"""
+        """Obtiene estadísticas sobre las colas (los cuatro contadores en un único MGET)"""
+        pending, processing, completed, failed = self.redis.mget(
+            REDIS_COUNTER_PENDING,
+            REDIS_COUNTER_PROCESSING,
+            REDIS_COUNTER_COMPLETED,
+            REDIS_COUNTER_FAILED
+        )
         return {
-            "pending": int(self.redis.get(REDIS_COUNTER_PENDING) or 0),
-            "processing": int(self.redis.get(REDIS_COUNTER_PROCESSING) or 0),
-            "completed": int(self.redis.get(REDIS_COUNTER_COMPLETED) or 0),
-            "failed": int(self.redis.get(REDIS_COUNTER_FAILED) or 0)
+            "pending": int(pending or 0),
+            "processing": int(processing or 0),
+            "completed": int(completed or 0),
+            "failed": int(failed or 0)
         }
     
     def reset_queues(self):
         """Resetea todas las colas (¡usar con precaución!)"""
-        self.redis.delete(
+        pipeline = self.redis.pipeline(transaction=False)
+        pipeline.delete(
             REDIS_QUEUE_PENDING,
             REDIS_QUEUE_PROCESSING,
             REDIS_QUEUE_COMPLETED,
@@ -133,4 +290,6 @@ class TaskManager:
             REDIS_COUNTER_COMPLETED,
             REDIS_COUNTER_FAILED
         )
+        self._publish_event(pipeline, "reset")
+        pipeline.execute()
         logger.warning("All queues have been reset")
\ No newline at end of file
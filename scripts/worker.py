@@ -52,7 +52,8 @@ class ScrapingWorker:
                     break
                 
                 # Obtener próxima tarea
-                task = self.task_manager.get_next_task()
+                # (espera bloqueada en Redis en lugar de dormir entre sondeos)
+                task = self.task_manager.get_next_task(timeout=5)
                 
                 if task:
                     # Reiniciar contador de tiempo inactivo
@@ -136,9 +137,6 @@ class ScrapingWorker:
                         logger.info(f"Idle timeout reached after {idle_time:.1f} seconds")
                         break
                     
-                    # Esperar un poco para no saturar Redis
-                    time.sleep(5)
-                    
                     # Mostrar estadísticas periódicamente
                     if int(idle_time) % 30 == 0:  # Cada 30 segundos
                         stats = self.task_manager.get_queue_stats()
@@ -152,6 +150,7 @@ class ScrapingWorker:
             traceback.print_exc()
         
         finally:
+            self.scraper.close()
             logger.info(f"Worker finished. Processed {tasks_processed} tasks")
 
 def main():